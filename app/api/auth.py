@@ -1,15 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, NamedTuple, Optional
 from jose import JWTError, jwt
 from pydantic import BaseModel
+import hashlib
+import time
 
-from ..db.session import get_db
+from ..db.session import get_async_db
 from ..db.models import User
 from ..core.config import settings
-from ..core.security import verify_password, get_password_hash, migrate_password_if_needed
+from ..cache.memory import BoundedMemoryCache
+from ..core.security import verify_password_async, get_password_hash, migrate_password_if_needed
 
 router = APIRouter()
 
@@ -28,17 +32,52 @@ class TokenData(BaseModel):
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
+class CachedUser(NamedTuple):
+    """Detached copy of the User columns request handlers read"""
+    id: int
+    username: str
+    email: str
+    is_active: bool
+
+
+# Verified tokens keyed by token hash; entries never outlive the token's exp
+_token_cache = BoundedMemoryCache(
+    max_bytes=settings.AUTH_CACHE_MAX_BYTES,
+    max_entries=settings.AUTH_CACHE_MAX_ENTRIES
+)
+# Bumped whenever a user row changes so their cached tokens stop matching
+_user_versions: Dict[str, int] = {}
+
+
+def invalidate_user(username: str):
+    _user_versions[username] = _user_versions.get(username, 0) + 1
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.username)
+    # A renamed user's tokens still carry the old name
+    for old_username in inspect(target).attrs.username.history.deleted:
+        invalidate_user(old_username)
+
+
+def token_cache_stats() -> Dict[str, Any]:
+    return _token_cache.stats()
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
 
-    migrate_password_if_needed(db, user, password)
+    await migrate_password_if_needed(db, user, password)
     
     return user
 
@@ -52,12 +91,24 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """Resolve a bearer token to the user it was issued for.
+
+    Verified tokens are cached with a detached CachedUser, so repeat
+    requests skip both the signature check and the user query.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cache_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cached = _token_cache.get(cache_key)
+    if cached is not None:
+        user, version, expires_at = cached
+        if _user_versions.get(user.username, 0) == version and expires_at > time.time():
+            return user
+
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
@@ -66,15 +117,24 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user_by_username(db, username=token_data.username)
+    # Read before the query so a change racing with it is not cached
+    version = _user_versions.get(token_data.username, 0)
+    user = await get_user_by_username(db, username=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+
+    cached_user = CachedUser(id=user.id, username=user.username, email=user.email, is_active=user.is_active)
+    expires_at = payload.get("exp")
+    if expires_at is not None:
+        ttl = min(expires_at - time.time(), settings.AUTH_CACHE_MAX_TTL)
+        if ttl > 0:
+            _token_cache.set(cache_key, (cached_user, version, expires_at), ttl=ttl)
+    return cached_user
 
 @router.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     try:
-        user = authenticate_user(db, form_data.username, form_data.password)
+        user = await authenticate_user(db, form_data.username, form_data.password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -86,6 +146,9 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             data={"sub": user.username}, expires_delta=access_token_expires
         )
         return {"access_token": access_token, "token_type": "bearer"}
+    except HTTPException:
+        # 401 for bad credentials, 503 when the password pool is saturated
+        raise
     except Exception as e:
         print(f"Authentication error: {str(e)}")
         raise HTTPException(
@@ -220,12 +220,39 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from pydantic import BaseModel
+import anyio
 
 from ..db.models import User, Product, Category, UserPreference, UserFeedback
 from ..db.session import get_db
+from ..recommender.catalog import catalog_store, get_catalog_version
+from ..recommender.index import recommender
+from .recommendation import catalog_generation
 
 router = APIRouter()
 
+
+def bump_catalog_generation():
+    """Invalidate cached search and recommendation results after a catalog write.
+
+    The handlers here are sync and run in the threadpool, so hop back to
+    the event loop for the async cache.
+    """
+    anyio.from_thread.run(catalog_generation.bump)
+
+
+def refresh_catalog_store(db: Session) -> str:
+    """Pull a committed product write into the catalog store with a delta query.
+
+    The store is marked stale first because two writes within the same
+    timestamp tick can leave the catalog fingerprint unchanged. Attached
+    shared workers keep no store and only read the version.
+    """
+    catalog_version = get_catalog_version(db)
+    if recommender.owns_catalog:
+        catalog_store.mark_stale()
+        catalog_store.refresh(db, catalog_version)
+    return catalog_version
+
 # ---- Pydantic models for request/response ----
 
 class UserBase(BaseModel):
@@ -358,6 +385,7 @@ def create_category(category: CategoryBase, db: Session = Depends(get_db)):
     db.add(db_category)
     db.commit()
     db.refresh(db_category)
+    bump_catalog_generation()
     return db_category
 
 @router.get("/categories/", response_model=List[CategoryResponse])
@@ -385,6 +413,9 @@ def create_product(product: ProductBase, db: Session = Depends(get_db)):
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
+    catalog_version = refresh_catalog_store(db)
+    recommender.record_upsert(catalog_store.fetch(db, [db_product.id])[0], catalog_version=catalog_version)
+    bump_catalog_generation()
     return db_product
 
 @router.get("/products/", response_model=List[ProductResponse])
@@ -434,6 +465,9 @@ def update_product(product_id: int, product: ProductBase, db: Session = Depends(
     
     db.commit()
     db.refresh(db_product)
+    catalog_version = refresh_catalog_store(db)
+    recommender.record_upsert(catalog_store.fetch(db, [db_product.id])[0], catalog_version=catalog_version)
+    bump_catalog_generation()
     return db_product
 
 @router.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -444,4 +478,6 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
     
     db.delete(db_product)
     db.commit()
+    recommender.record_delete(product_id, catalog_version=refresh_catalog_store(db))
+    bump_catalog_generation()
     return None
\ No newline at end of file
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from ..db.session import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..db.session import get_async_db
 from ..db.models import UserFeedback
 # from ..core.security import get_current_user
 from app.api.auth import get_current_user, oauth2_scheme
@@ -13,7 +13,7 @@ async def submit_feedback(
     rating: int,
     comment: str,
     current_user=Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     feedback = UserFeedback(
         user_id=current_user.id,
@@ -22,5 +22,5 @@ async def submit_feedback(
         comment=comment
     )
     db.add(feedback)
-    db.commit()
+    await db.commit()
     return {"message": "Feedback submitted successfully"}
\ No newline at end of file
@@ -1,20 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Header
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Header, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional, Tuple
 import logging
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import asyncio
+import base64
+import hashlib
+import json
+import time
 
-from app.db.session import get_db
-from app.db.models import Product
-from app.api.auth import get_current_user, oauth2_scheme
+from app.core.config import settings
+from app.db.session import get_async_db, SessionLocal
+from app.api.auth import get_current_user, oauth2_scheme, token_cache_stats
+from app.cache.generation import CatalogGeneration
 from app.cache.redis import MemcachedClient
+from app.cache.singleflight import SingleFlight
 from app.llm.client import LLMClient
+from app.recommender.embeddings import embedding_index
+from app.recommender.executor import recommend_similar_products
+from app.recommender.catalog import catalog_store
+from app.recommender.index import recommender
+from app.recommender.query import normalize_query
 
 router = APIRouter()
 redis_client = MemcachedClient()
+# Embedded in result cache keys; bumped by catalog writes in crud.py
+catalog_generation = CatalogGeneration(redis_client)
 llm_client = LLMClient()
+single_flight = SingleFlight()
+# Strong references to LLM calls that outlived their latency budget
+_background_tasks = set()
+# Candidates and LLM ranking task per hybrid cache key, shared until the LLM answers
+_hybrid_in_flight: Dict[str, asyncio.Future] = {}
 logger = logging.getLogger(__name__)
 
 # Function to extract token
@@ -27,74 +44,97 @@ async def extract_token(authorization: Optional[str], token_param: Optional[str]
         logger.error("No authentication token provided")
         raise HTTPException(status_code=401, detail="Authentication required")
 
-class ProductRecommender:
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(stop_words='english')
-        self.product_vectors = None
-        self.products = None
-    
-    def fit(self, products):
-        """Create vector representations of products"""
-        self.products = products
-        
-        texts = [f"{p['name']} {p['description']} {p['category']}" for p in products]
+def _encode_cursor(scope: str, position: int) -> str:
+    payload = json.dumps({"s": _cursor_scope(scope), "p": position}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
 
-        try:
-            self.product_vectors = self.vectorizer.fit_transform(texts)
-            logger.info(f"Created vectors for {len(products)} products")
-        except Exception as e:
-            logger.error(f"Error creating product vectors: {str(e)}")
-            raise
-    
-    def recommend_similar_products(self, query, top_k=5):
-        if not self.products or self.product_vectors is None:
-            logger.error("Recommender not fitted with product data")
-            raise ValueError("Recommender not fitted with product data")
+def _decode_cursor(cursor: Optional[str], scope: str) -> int:
+    """Position encoded in an opaque cursor; 0 when no cursor was given"""
+    if not cursor:
+        return 0
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        position = int(data["p"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if data.get("s") != _cursor_scope(scope) or position < 0:
+        raise HTTPException(status_code=400, detail="Cursor does not belong to this query")
+    return position
 
-        query_vector = self.vectorizer.transform([query])
-    
-        similarities = cosine_similarity(query_vector, self.product_vectors).flatten()
-        
-        top_indices = similarities.argsort()[-top_k:][::-1]
+def _cursor_scope(scope: str) -> str:
+    return hashlib.sha256(scope.encode("utf-8")).hexdigest()[:16]
 
-        recommendations = []
-        for idx in top_indices:
-            product = self.products[idx]
-            match_score = int(similarities[idx] * 100)  # Convert to 0-100 scale
-            
-            price_formatted = f"{product['price']:.2f} USD"
-            
-            recommendation = {
-                "id": product["id"],
-                "name": product["name"],
-                "description": product.get("description", ""),
-                "price": price_formatted,
-                "category": product["category"],
-                "brand": product.get("brand", "Unknown"),
-                "reviews_count": product.get("reviews_count", 0),
-                "match_score": match_score,
-                "reason": self._generate_reason(product, query, match_score)
-            }
-            recommendations.append(recommendation)
-        
-        return recommendations
-    
-    def _generate_reason(self, product, query, match_score):
-        """Generate human-readable reason for recommendation"""
-        reason = f"This product matches your search for '{query}'."
+@router.get("/index/")
+async def get_index_status(
+    authorization: Optional[str] = Header(None),
+    token_param: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Report the catalog version and build time of the recommendation index"""
+    token = await extract_token(authorization, token_param)
+    current_user = await get_current_user(token=token, db=db)
 
-        if product.get("brand"):
-            reason += f" Brand: {product['brand']}."
+    return recommender.info()
 
-        if product.get("reviews_count", 0) > 0:
-            reason += f" Has {product['reviews_count']} reviews."
-        
+@router.get("/stats/")
+async def get_recommendation_stats(
+    authorization: Optional[str] = Header(None),
+    token_param: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Counters for the recommendation index and caches"""
+    token = await extract_token(authorization, token_param)
+    current_user = await get_current_user(token=token, db=db)
 
-        reason += f" Match Score: {match_score}/100"
-        
-        return reason
+    return {
+        "index": recommender.info(),
+        "catalog_store": catalog_store.stats(),
+        "embedding_index": embedding_index.stats(),
+        "response_cache": redis_client.stats(),
+        "auth_cache": token_cache_stats(),
+        "catalog_generation": {"current": await catalog_generation.current(), "bumps": catalog_generation.bumps},
+        "llm_cache": llm_client.prompt_cache.stats(),
+        "explanation_cache": llm_client.explanation_cache.stats(),
+        "llm_batching": llm_client.batcher.stats(),
+        "llm_streaming": llm_client.stream_stats(),
+        "single_flight": single_flight.stats(),
+    }
 
-recommender = ProductRecommender()
+@router.get("/similar/{product_id}", response_model=List[Dict[str, Any]])
+async def get_vector_similar_products(
+    product_id: int,
+    limit: int = Query(10, gt=0, le=100),
+    nprobe: Optional[int] = Query(None, gt=0, description="IVF cells to probe; higher trades latency for recall"),
+    authorization: Optional[str] = Header(None),
+    token_param: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Recommend products whose embeddings are closest to the given product"""
+    token = await extract_token(authorization, token_param)
+    current_user = await get_current_user(token=token, db=db)
+
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _refresh_embedding_index)
+        neighbours = embedding_index.similar_to_product(product_id, top_k=limit, nprobe=nprobe)
+
+        products = {p["id"]: p for p in recommender.get_products(pid for pid, _ in neighbours)}
+
+        results = []
+        for pid, similarity in neighbours:
+            product = products.get(pid)
+            if product is None:
+                continue
+            match_score = max(int(similarity * 100), 0)
+            product["price"] = f"{product['price']:.2f} USD"
+            product["match_score"] = match_score
+            product["reason"] = f"Similar to product {product_id} by embedding. Match Score: {match_score}/100"
+            results.append(product)
+    except Exception as e:
+        logger.error(f"Error finding vector-similar products: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error finding similar products")
+
+    return results
 
 # Fixed: Return a list instead of a dictionary to match response_model
 # @router.get("/recommendations/similar/", response_model=List[Dict[str, Any]])
@@ -162,50 +202,44 @@ recommender = ProductRecommender()
     
 #     return recommendations
 
-# Fixed: Return a list instead of a dictionary
-@router.get("/search/", response_model=List[Dict[str, Any]])
-async def search_products(
-    query: str,
-    limit: int = Query(20, gt=0, le=100),
-    authorization: Optional[str] = Header(None),
-    token_param: Optional[str] = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-):
-    """Search for products and provide similar products recommendations"""
-    token = await extract_token(authorization, token_param)
-    current_user = await get_current_user(token=token, db=db)
+def _refresh_index():
+    """Bring the index up to date using a session owned by the computation.
 
-    cache_key = f"search:{query}:{limit}"
-    cached_data = await redis_client.get(cache_key)
-    if cached_data:
-        logger.info(f"Returning cached search results for query '{query}'")
-        return cached_data
+    Coalesced computations can outlive the request that started them, so
+    they must not borrow that request's session.
+    """
+    db = SessionLocal()
+    try:
+        recommender.ensure_fresh(db)
+    finally:
+        db.close()
 
+def _refresh_embedding_index():
+    db = SessionLocal()
     try:
-        exact_matches = db.query(Product).filter(
-            Product.name.ilike(f"%{query}%") |
-            Product.description.ilike(f"%{query}%")
-        ).limit(limit).all()
-        
-        all_products = db.query(Product).all()
-        
-        product_data = [
-            {
-                "id": p.id,
-                "name": p.name,
-                "description": p.description,
-                "price": p.price,
-                "category": p.category.name,
-                "image_url": p.image_url,
-                "brand": getattr(p, 'brand', 'Unknown'),
-                "reviews_count": getattr(p, 'reviews_count', 0)
-            }
-            for p in all_products
-        ]
+        recommender.ensure_fresh(db)
+        embedding_index.ensure_fresh(db, recommender.catalog_version)
+    finally:
+        db.close()
+
+async def _single_flight(cache_key: str, compute):
+    """Run compute once for all concurrent callers of the same cache key"""
+    try:
+        return await single_flight.do(cache_key, compute, timeout=settings.SINGLE_FLIGHT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(f"Timed out waiting for in-flight computation of '{cache_key}'")
+        raise HTTPException(status_code=504, detail="Timed out generating recommendations")
+
+async def _refresh_index_off_loop():
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _refresh_index)
+
+async def _compute_search_results(query: str, limit: int) -> List[Dict[str, Any]]:
+    try:
+        await _refresh_index_off_loop()
         
-        if product_data:
-            recommender.fit(product_data)
-            results = recommender.recommend_similar_products(
+        if recommender.has_products:
+            results = await recommend_similar_products(
                 query=query,
                 top_k=limit
             )
@@ -216,160 +250,448 @@ async def search_products(
         logger.error(f"Error searching products: {str(e)}")
         raise HTTPException(status_code=500, detail="Error searching products")
 
+    return results
+
+async def _await_within_budget(task: asyncio.Task, deadline: float):
+    """Await task until the loop-time deadline; on expiry leave it running in the background.
+
+    A late result still fills the LLM prompt cache for the next caller.
+    """
+    remaining = max(deadline - asyncio.get_running_loop().time(), 0)
     try:
-        await redis_client.set(cache_key, results, expire=600)  # 10 min
-    except Exception as e:
-        logger.warning(f"Failed to cache search results: {str(e)}")
+        return await asyncio.wait_for(asyncio.shield(task), remaining)
+    except asyncio.TimeoutError:
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        raise
+
+async def _retrieve_hybrid_candidates(query: str) -> List[Dict[str, Any]]:
+    """One retrieval serves both the TF-IDF results and the LLM's candidate set"""
+    await _refresh_index_off_loop()
+    return await recommend_similar_products(
+        query=query,
+        top_k=max(settings.RANKED_LIST_SIZE, settings.LLM_CANDIDATE_COUNT)
+    )
+
+def _start_llm_ranking(query: str, candidates: List[Dict[str, Any]]) -> asyncio.Task:
+    query_prompt = f"Find products similar to '{query}'. The customer is looking for products like: {query}"
+    # The prompt is built from catalog rows, not the formatted TF-IDF results
+    products = recommender.get_products(c['id'] for c in candidates[:settings.LLM_CANDIDATE_COUNT])
     
-    return results
-@router.get("/recommendations/", response_model=List[Dict[str, Any]])
-async def get_hybrid_recommendations(
-    query: str = Query(..., description="Search query/title to find recommendations for"),
-    limit: int = Query(10, gt=0, le=100),
-    tfidf_weight: float = Query(0.5, ge=0.0, le=1.0, description="Weight for TF-IDF recommendations"),
-    min_score: int = Query(20, ge=0, le=100, description="Minimum match score threshold"),
-    authorization: Optional[str] = Header(None),
-    token_param: Optional[str] = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-):
-    token = await extract_token(authorization, token_param)
-    current_user = await get_current_user(token=token, db=db)
+    return asyncio.ensure_future(llm_client.generate_recommendations(
+        user_preferences=query_prompt,
+        product_descriptions=products,
+        top_k=min(settings.LLM_RANKING_TOP_K, settings.LLM_CANDIDATE_COUNT),
+        catalog_version=recommender.catalog_version
+    ))
+
+async def _start_hybrid_ranking(cache_key: str, query: str) -> Tuple[List[Dict[str, Any]], asyncio.Task]:
+    """Retrieve candidates and start the LLM ranking once per hybrid cache key.
+
+    Concurrent callers, streaming or not, share the retrieval and the
+    in-flight LLM task; each one still waits on it under its own budget.
+    """
+    future = _hybrid_in_flight.get(cache_key)
+    if future is None:
+        async def start():
+            candidates = await _retrieve_hybrid_candidates(query)
+            return candidates, _start_llm_ranking(query, candidates)
+
+        future = asyncio.ensure_future(start())
+        _hybrid_in_flight[cache_key] = future
+
+        def forget(_):
+            if _hybrid_in_flight.get(cache_key) is future:
+                del _hybrid_in_flight[cache_key]
+
+        def started(f):
+            if f.cancelled() or f.exception() is not None:
+                forget(f)
+            else:
+                f.result()[1].add_done_callback(forget)
+
+        future.add_done_callback(started)
+
+    return await asyncio.shield(future)
 
-    cache_key = f"hybrid_recommendations:query:{query}:{tfidf_weight}:{limit}:{min_score}"
-    cached_data = await redis_client.get(cache_key)
-    if cached_data:
-        logger.info(f"Returning cached hybrid recommendations for query '{query}'")
-        return cached_data
+async def _compute_hybrid_rankings(cache_key: str, query: str, llm_budget_ms: int) -> Tuple[Dict[str, List[Dict[str, Any]]], bool]:
+    """Full TF-IDF and LLM rankings for a normalized query, independent of limit and weighting.
 
+    The flag is True when the LLM stage missed its budget.
+    """
+    partial = False
     try:
-        logger.info(f"Getting recommendations for query: '{query}' with min score: {min_score}")
-
-        all_products = db.query(Product).all()
-
-        product_data = [
-            {
-                "id": p.id,
-                "name": p.name,
-                "description": p.description,
-                "price": p.price,
-                "category": p.category.name,
-                "image_url": p.image_url,
-                "brand": getattr(p, 'brand', 'Unknown'),
-                "reviews_count": getattr(p, 'reviews_count', 0)
-            }
-            for p in all_products
-        ]
-
-        recommender.fit(product_data)
-        tfidf_recommendations = recommender.recommend_similar_products(
-            query=query,  
-            top_k=limit*2 
+        logger.info(f"Ranking hybrid recommendation candidates for query: '{query}'")
+
+        deadline = asyncio.get_running_loop().time() + llm_budget_ms / 1000
+        candidates, llm_task = await _start_hybrid_ranking(cache_key, query)
+        
+        try:
+            llm_recommendations = await _await_within_budget(llm_task, deadline)
+        except asyncio.TimeoutError:
+            logger.warning(f"LLM stage missed its {llm_budget_ms} ms budget for query '{query}', returning content-based results")
+            llm_recommendations = []
+            partial = True
+    except Exception as e:
+        logger.error(f"Error generating hybrid recommendations: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error generating hybrid recommendations")
+
+    return {"tfidf": candidates, "llm": llm_recommendations}, partial
+
+def _hybrid_page(
+    rankings: Dict[str, List[Dict[str, Any]]],
+    query: str,
+    limit: int,
+    tfidf_weight: float,
+    min_score: int,
+    page_index: int
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """Merge one page out of cached rankings; the flag is True when another page follows.
+
+    Earlier pages are replayed (cheap, all in memory) so every page keeps
+    the tfidf_weight mix and no product repeats across pages.
+    """
+    pages = []
+    served = set()
+    while len(pages) <= page_index + 1:
+        page = _merge_hybrid_recommendations(
+            query, limit, tfidf_weight, min_score,
+            [dict(r) for r in rankings["tfidf"]],
+            [dict(r) for r in rankings["llm"]],
+            exclude_ids=served
         )
+        if not page:
+            break
+        served.update(rec['id'] for rec in page)
+        pages.append(page)
+
+    if page_index >= len(pages):
+        return [], False
+    return pages[page_index], len(pages) > page_index + 1
+
+def _merge_hybrid_recommendations(
+    query: str,
+    limit: int,
+    tfidf_weight: float,
+    min_score: int,
+    tfidf_recommendations: List[Dict[str, Any]],
+    llm_recommendations: List[Dict[str, Any]],
+    exclude_ids: Optional[set] = None
+) -> List[Dict[str, Any]]:
+    """Blend TF-IDF and LLM results; the records passed in are labelled in place"""
+    filtered_tfidf_recs = [rec for rec in tfidf_recommendations if rec.get('match_score', 0) > min_score]
+    
+    filtered_llm_recs = []
+    for prod in llm_recommendations:
+        score = prod.get('match_score', 0)
         
-        filtered_tfidf_recs = [rec for rec in tfidf_recommendations if rec.get('match_score', 0) > min_score]
+        if isinstance(score, (int, float)) and score <= min_score:
+            continue
+            
+        if isinstance(prod.get('price'), (int, float)):
+            prod['price'] = f"{prod['price']:.2f} USD"
         
-        query_prompt = f"Find products similar to '{query}'. The customer is looking for products like: {query}"
+        if isinstance(score, (int, float)):
+            if score >= 80:
+                prod['match_score'] = 'Excellent'
+            elif score >= 60:
+                prod['match_score'] = 'Good'
+            elif score >= 40:
+                prod['match_score'] = 'Fair'
+            else:
+                prod['match_score'] = 'Low'
         
-        llm_recommendations = await llm_client.generate_recommendations(
-            user_preferences=query_prompt,
-            product_descriptions=product_data,
-            top_k=limit*2  
-        )
-        filtered_llm_recs = []
-        for prod in llm_recommendations:
-            score = prod.get('match_score', 0)
+        if 'reason' not in prod:
+            prod['reason'] = f"Recommended based on your search for '{query}'. Brand: {prod.get('brand', 'Unknown')}."
             
-            if isinstance(score, (int, float)) and score <= min_score:
-                continue
-                
-            if isinstance(prod.get('price'), (int, float)):
-                prod['price'] = f"{prod['price']:.2f} USD"
+        filtered_llm_recs.append(prod)
+
+    included_ids = set(exclude_ids or ())
+    hybrid_recommendations = []
+    
+    tfidf_count = int(limit * tfidf_weight)
+    llm_count = limit - tfidf_count
+
+    for rec in filtered_tfidf_recs:
+        if len(hybrid_recommendations) >= tfidf_count:
+            break
             
-            if isinstance(score, (int, float)):
+        if rec['id'] not in included_ids:
+            included_ids.add(rec['id'])
+            score = rec.get('match_score', 0)
+            if isinstance(score, int) or isinstance(score, float):
                 if score >= 80:
-                    prod['match_score'] = 'Excellent'
+                    rec['match_score'] = 'Excellent'
                 elif score >= 60:
-                    prod['match_score'] = 'Good'
+                    rec['match_score'] = 'Good'
                 elif score >= 40:
-                    prod['match_score'] = 'Fair'
+                    rec['match_score'] = 'Fair'
                 else:
-                    prod['match_score'] = 'Low'
+                    rec['match_score'] = 'Low'
+            rec['source'] = 'Content-Based'
+            hybrid_recommendations.append(rec)
+    
+    for rec in filtered_llm_recs:
+        if len(hybrid_recommendations) >= limit:
+            break
             
-            if 'reason' not in prod:
-                prod['reason'] = f"Recommended based on your search for '{query}'. Brand: {prod.get('brand', 'Unknown')}."
-                
-            filtered_llm_recs.append(prod)
+        if rec['id'] not in included_ids:
+            included_ids.add(rec['id'])
+            rec['source'] = 'Title-Based'
+            hybrid_recommendations.append(rec)
     
-        included_ids = set()
-        hybrid_recommendations = []
-        
-        tfidf_count = int(limit * tfidf_weight)
-        llm_count = limit - tfidf_count
-
-        for rec in filtered_tfidf_recs:
-            if len(hybrid_recommendations) >= tfidf_count:
-                break
-                
-            if rec['id'] not in included_ids:
-                included_ids.add(rec['id'])
-                score = rec.get('match_score', 0)
-                if isinstance(score, int) or isinstance(score, float):
-                    if score >= 80:
-                        rec['match_score'] = 'Excellent'
-                    elif score >= 60:
-                        rec['match_score'] = 'Good'
-                    elif score >= 40:
-                        rec['match_score'] = 'Fair'
-                    else:
-                        rec['match_score'] = 'Low'
-                rec['source'] = 'Content-Based'
-                hybrid_recommendations.append(rec)
-        
-        for rec in filtered_llm_recs:
-            if len(hybrid_recommendations) >= limit:
-                break
-                
-            if rec['id'] not in included_ids:
-                included_ids.add(rec['id'])
-                rec['source'] = 'Title-Based'
-                hybrid_recommendations.append(rec)
-        
-        remaining_tfidf = [r for r in filtered_tfidf_recs if r['id'] not in included_ids]
-        remaining_llm = [r for r in filtered_llm_recs if r['id'] not in included_ids]
-        remaining_recs = []
-        for i in range(max(len(remaining_tfidf), len(remaining_llm))):
-            if i < len(remaining_tfidf):
-                remaining_recs.append(remaining_tfidf[i])
-            if i < len(remaining_llm):
-                remaining_recs.append(remaining_llm[i])
-        
-        for rec in remaining_recs:
-            if len(hybrid_recommendations) >= limit:
-                break
-                
-            if rec['id'] not in included_ids:
-                included_ids.add(rec['id'])
-                score = rec.get('match_score', 0)
-                if isinstance(score, int) or isinstance(score, float):
-                    if score >= 80:
-                        rec['match_score'] = 'Excellent'
-                    elif score >= 60:
-                        rec['match_score'] = 'Good'
-                    elif score >= 40:
-                        rec['match_score'] = 'Fair'
-                    else:
-                        rec['match_score'] = 'Low'
-                rec['source'] = 'Additional'
-                hybrid_recommendations.append(rec)
-                
-        logger.info(f"Generated {len(hybrid_recommendations)} hybrid recommendations for query '{query}' (requested {limit}, min score {min_score})")
-    except Exception as e:
-        logger.error(f"Error generating hybrid recommendations: {str(e)}")
-        raise HTTPException(status_code=500, detail="Error generating hybrid recommendations")
+    remaining_tfidf = [r for r in filtered_tfidf_recs if r['id'] not in included_ids]
+    remaining_llm = [r for r in filtered_llm_recs if r['id'] not in included_ids]
+    remaining_recs = []
+    for i in range(max(len(remaining_tfidf), len(remaining_llm))):
+        if i < len(remaining_tfidf):
+            remaining_recs.append(remaining_tfidf[i])
+        if i < len(remaining_llm):
+            remaining_recs.append(remaining_llm[i])
+    
+    for rec in remaining_recs:
+        if len(hybrid_recommendations) >= limit:
+            break
+            
+        if rec['id'] not in included_ids:
+            included_ids.add(rec['id'])
+            score = rec.get('match_score', 0)
+            if isinstance(score, int) or isinstance(score, float):
+                if score >= 80:
+                    rec['match_score'] = 'Excellent'
+                elif score >= 60:
+                    rec['match_score'] = 'Good'
+                elif score >= 40:
+                    rec['match_score'] = 'Fair'
+                else:
+                    rec['match_score'] = 'Low'
+            rec['source'] = 'Additional'
+            hybrid_recommendations.append(rec)
 
-    try:
-        await redis_client.set(cache_key, hybrid_recommendations, expire=1800)  # 30 min
-    except Exception as e:
-        logger.warning(f"Failed to cache hybrid recommendations: {str(e)}")
+    return hybrid_recommendations
+
+# Fixed: Return a list instead of a dictionary
+@router.get("/search/", response_model=List[Dict[str, Any]])
+async def search_products(
+    response: Response,
+    query: str,
+    limit: int = Query(20, gt=0, le=100),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    authorization: Optional[str] = Header(None),
+    token_param: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Search for products and provide similar products recommendations"""
+    token = await extract_token(authorization, token_param)
+    current_user = await get_current_user(token=token, db=db)
+
+    # One ranked list per normalized query serves every limit and page
+    normalized_query = normalize_query(query)
+    offset = _decode_cursor(cursor, f"search:{normalized_query}")
+    cache_key = f"search:g{await catalog_generation.current()}:{normalized_query}"
+
+    async def compute():
+        return await _single_flight(
+            cache_key,
+            lambda: _compute_search_results(normalized_query, settings.RANKED_LIST_SIZE)
+        )
+
+    # Stale entries are served at once and refreshed in the background
+    ranked = await redis_client.get_or_compute(
+        cache_key,
+        compute,
+        soft_ttl=settings.SEARCH_CACHE_SOFT_TTL,
+        hard_ttl=settings.SEARCH_CACHE_TTL
+    )
+    if offset + limit < len(ranked):
+        response.headers["X-Next-Cursor"] = _encode_cursor(f"search:{normalized_query}", offset + limit)
+    return ranked[offset:offset + limit]
+
+async def _hybrid_cache_key(normalized_query: str) -> str:
+    return f"hybrid_recommendations:g{await catalog_generation.current()}:{normalized_query}"
+
+def _hybrid_rankings_compute(cache_key: str, normalized_query: str, llm_budget_ms: int):
+    """compute callable for a hybrid cache entry, and the dict its partial flag lands in"""
+    state = {"partial": False}
+
+    async def compute():
+        rankings, state["partial"] = await _single_flight(
+            f"{cache_key}:{llm_budget_ms}",
+            lambda: _compute_hybrid_rankings(cache_key, normalized_query, llm_budget_ms)
+        )
+        return rankings
+
+    return compute, state
+
+async def _get_hybrid_rankings(normalized_query: str, llm_budget_ms: int) -> Tuple[Dict[str, List[Dict[str, Any]]], bool]:
+    cache_key = await _hybrid_cache_key(normalized_query)
+    compute, state = _hybrid_rankings_compute(cache_key, normalized_query, llm_budget_ms)
+
+    # Partial results are not cached so the next caller picks up the late LLM answer
+    rankings = await redis_client.get_or_compute(
+        cache_key,
+        compute,
+        soft_ttl=settings.HYBRID_CACHE_SOFT_TTL,
+        hard_ttl=settings.HYBRID_CACHE_TTL,
+        cacheable=lambda _: not state["partial"]
+    )
+    return rankings, state["partial"]
+
+def _hybrid_cursor_scope(normalized_query: str, limit: int, tfidf_weight: float, min_score: int) -> str:
+    # Leaves out the catalog generation so a write does not break clients mid-pagination
+    return f"hybrid_recommendations:{normalized_query}:{tfidf_weight}:{limit}:{min_score}"
+
+@router.get("/recommendations/", response_model=List[Dict[str, Any]])
+async def get_hybrid_recommendations(
+    response: Response,
+    query: str = Query(..., description="Search query/title to find recommendations for"),
+    limit: int = Query(10, gt=0, le=100),
+    tfidf_weight: float = Query(0.5, ge=0.0, le=1.0, description="Weight for TF-IDF recommendations"),
+    min_score: int = Query(20, ge=0, le=100, description="Minimum match score threshold"),
+    llm_budget_ms: Optional[int] = Query(None, gt=0, le=60000, description="Latency budget for the LLM stage in milliseconds"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    authorization: Optional[str] = Header(None),
+    token_param: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+):
+    token = await extract_token(authorization, token_param)
+    current_user = await get_current_user(token=token, db=db)
+
+    if llm_budget_ms is None:
+        llm_budget_ms = settings.LLM_LATENCY_BUDGET_MS
+
+    normalized_query = normalize_query(query)
+    scope = _hybrid_cursor_scope(normalized_query, limit, tfidf_weight, min_score)
+    page_index = _decode_cursor(cursor, scope)
+
+    rankings, partial = await _get_hybrid_rankings(normalized_query, llm_budget_ms)
+    hybrid_recommendations, has_more = _hybrid_page(rankings, query, limit, tfidf_weight, min_score, page_index)
+    logger.info(f"Returning {len(hybrid_recommendations)} hybrid recommendations for query '{query}' (requested {limit}, min score {min_score}, page {page_index}, partial {partial})")
+
+    if has_more:
+        response.headers["X-Next-Cursor"] = _encode_cursor(scope, page_index + 1)
+    if partial:
+        response.headers["X-Partial-Results"] = "llm-timeout"
+    return hybrid_recommendations
+
+def _stream_record(record_type: str, data: Dict[str, Any], stream_format: str) -> str:
+    if stream_format == "sse":
+        return f"event: {record_type}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"type": record_type, **data}) + "\n"
+
+@router.get("/recommendations/stream/")
+async def stream_hybrid_recommendations(
+    query: str = Query(..., description="Search query/title to find recommendations for"),
+    limit: int = Query(10, gt=0, le=100),
+    tfidf_weight: float = Query(0.5, ge=0.0, le=1.0, description="Weight for TF-IDF recommendations"),
+    min_score: int = Query(20, ge=0, le=100, description="Minimum match score threshold"),
+    llm_budget_ms: Optional[int] = Query(None, gt=0, le=60000, description="Latency budget for the LLM stage in milliseconds"),
+    stream_format: str = Query("ndjson", alias="format", pattern="^(ndjson|sse)$", description="ndjson or sse"),
+    authorization: Optional[str] = Header(None),
+    token_param: Optional[str] = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Progressive variant of /recommendations/.
+
+    Content-Based items are sent as soon as TF-IDF retrieval finishes, the
+    Title-Based and Additional items follow once the LLM stage answers (or
+    misses its budget), and a final summary record closes the stream. The
+    items and their order match the first page of /recommendations/, and
+    the summary carries the cursor for the next page there.
+    """
+    token = await extract_token(authorization, token_param)
+    current_user = await get_current_user(token=token, db=db)
+
+    if llm_budget_ms is None:
+        llm_budget_ms = settings.LLM_LATENCY_BUDGET_MS
+
+    started = time.perf_counter()
+    normalized_query = normalize_query(query)
+    cache_key = await _hybrid_cache_key(normalized_query)
+    scope = _hybrid_cursor_scope(normalized_query, limit, tfidf_weight, min_score)
+    compute, state = _hybrid_rankings_compute(cache_key, normalized_query, llm_budget_ms)
+    # Stale entries are served at once and refreshed in the background, as in /recommendations/
+    cached_rankings = await redis_client.get_cached(
+        cache_key,
+        compute,
+        soft_ttl=settings.HYBRID_CACHE_SOFT_TTL,
+        hard_ttl=settings.HYBRID_CACHE_TTL,
+        cacheable=lambda _: not state["partial"]
+    )
+
+    llm_task = None
+    if not cached_rankings:
+        try:
+            deadline = asyncio.get_running_loop().time() + llm_budget_ms / 1000
+            # Shares retrieval and the LLM call with concurrent streams and /recommendations/ misses
+            candidates, llm_task = await _start_hybrid_ranking(cache_key, normalized_query)
+        except Exception as e:
+            logger.error(f"Error generating hybrid recommendations: {str(e)}")
+            raise HTTPException(status_code=500, detail="Error generating hybrid recommendations")
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+
+    def summary(count: int, partial: bool, cached: bool, has_more: bool, **timings) -> str:
+        record = {"count": count, "partial": partial, "cached": cached, **timings}
+        record["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if has_more:
+            record["next_cursor"] = _encode_cursor(scope, 1)
+        return _stream_record("summary", record, stream_format)
+
+    async def records():
+        if cached_rankings:
+            page, has_more = _hybrid_page(cached_rankings, query, limit, tfidf_weight, min_score, 0)
+            for rec in page:
+                yield _stream_record("recommendation", rec, stream_format)
+            yield summary(len(page), partial=False, cached=True, has_more=has_more)
+            return
+
+        partial = False
+        sent_ids = set()
+        try:
+            # Merging without LLM output yields exactly the Content-Based head of the final page
+            head = _merge_hybrid_recommendations(
+                query, limit, tfidf_weight, min_score, [dict(r) for r in candidates], []
+            )
+            for rec in head:
+                if rec['source'] != 'Content-Based':
+                    break
+                sent_ids.add(rec['id'])
+                yield _stream_record("recommendation", rec, stream_format)
+            first_result_ms = round((time.perf_counter() - started) * 1000, 1)
+
+            try:
+                llm_recommendations = await _await_within_budget(llm_task, deadline)
+            except asyncio.TimeoutError:
+                logger.warning(f"LLM stage missed its {llm_budget_ms} ms budget for query '{query}', streaming content-based results only")
+                llm_recommendations = []
+                partial = True
+
+            rankings = {"tfidf": candidates, "llm": llm_recommendations}
+            page, has_more = _hybrid_page(rankings, query, limit, tfidf_weight, min_score, 0)
+            for rec in page:
+                if rec['id'] not in sent_ids:
+                    sent_ids.add(rec['id'])
+                    yield _stream_record("recommendation", rec, stream_format)
+
+            if not partial:
+                await redis_client.put(
+                    cache_key,
+                    rankings,
+                    soft_ttl=settings.HYBRID_CACHE_SOFT_TTL,
+                    hard_ttl=settings.HYBRID_CACHE_TTL,
+                    compute_seconds=time.perf_counter() - started
+                )
+
+            yield summary(len(sent_ids), partial=partial, cached=False, has_more=has_more, first_result_ms=first_result_ms)
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            logger.error(f"Error streaming hybrid recommendations: {str(e)}")
+            yield _stream_record("error", {"detail": "Error generating hybrid recommendations"}, stream_format)
+        finally:
+            # A disconnected client should not waste the LLM answer; it still fills the prompt cache
+            if not llm_task.done():
+                _background_tasks.add(llm_task)
+                llm_task.add_done_callback(_background_tasks.discard)
 
-    return hybrid_recommendations
\ No newline at end of file
+    return StreamingResponse(records(), media_type=media_type)
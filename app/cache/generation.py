@@ -0,0 +1,75 @@
+import hashlib
+import logging
+import time
+
+from app.cache.redis import MemcachedClient
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.recommender.catalog import catalog_version_select, format_catalog_version
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogGeneration:
+    """Namespace for cache keys that changes on every catalog write.
+
+    Bumping makes every key built from the previous generation unreachable
+    at once, without scanning for keys; the orphaned entries age out through
+    normal LRU eviction and TTLs. With the Redis tier the counter is a shared
+    INCR key that workers re-read at most every CATALOG_GENERATION_CHECK_SECONDS.
+    Without it the counter only sees this process's writes, so the namespace
+    also carries a digest of the database catalog version, re-read on the
+    same interval, which picks up writes handled by other workers.
+    """
+
+    KEY = "catalog:generation"
+
+    def __init__(self, cache: MemcachedClient):
+        self.cache = cache
+        self.value = 0
+        self.catalog_digest = ""
+        self._checked_until = 0.0
+        self.bumps = 0
+
+    async def current(self) -> str:
+        if time.monotonic() < self._checked_until:
+            return self._namespace()
+
+        if self.cache.redis is not None:
+            try:
+                self.value = int(await self.cache.redis.get(self.KEY) or 0)
+            except Exception as e:
+                logger.warning(f"Failed to read catalog generation: {str(e)}")
+                return self._namespace()
+        else:
+            try:
+                await self._read_catalog_version()
+            except Exception as e:
+                logger.warning(f"Failed to read catalog version: {str(e)}")
+                return self._namespace()
+        self._checked_until = time.monotonic() + settings.CATALOG_GENERATION_CHECK_SECONDS
+        return self._namespace()
+
+    async def _read_catalog_version(self):
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(catalog_version_select())).one()
+        version = format_catalog_version(*row)
+        self.catalog_digest = hashlib.sha256(version.encode("utf-8")).hexdigest()[:12]
+
+    def _namespace(self) -> str:
+        if self.cache.redis is not None:
+            return str(self.value)
+        return f"{self.value}-{self.catalog_digest}"
+
+    async def bump(self) -> str:
+        """Start a new generation; never raises, so a cache outage cannot fail a write"""
+        self.bumps += 1
+        self.value += 1
+        if self.cache.redis is not None:
+            try:
+                self.value = int(await self.cache.redis.incr(self.KEY))
+                self._checked_until = time.monotonic() + settings.CATALOG_GENERATION_CHECK_SECONDS
+            except Exception as e:
+                logger.warning(f"Failed to bump catalog generation: {str(e)}")
+        logger.info(f"Catalog generation is now {self.value}")
+        return self._namespace()
@@ -1,100 +1,389 @@
-# import json
-# import pickle
-# from typing import Any, Optional, Union
-# import redis.asyncio as redis
-
-# from app.core.config import settings
-
-# class MemcachedClient:
-    
-#     def __init__(self):
-#         self.redis = redis.Redis(
-#             host=settings.REDIS_HOST,
-#             port=settings.REDIS_PORT,
-#             db=settings.REDIS_DB,
-#             password=settings.REDIS_PASSWORD,
-#             decode_responses=False
-#         )
-        
-#     async def get(self, key: str) -> Optional[Any]:
-#         data = await self.redis.get(key)
-        
-#         if not data:
-#             return None
-            
-#         try:
-#             return pickle.loads(data)
-#         except Exception:
-#             return None
-    
-#     async def set(self, key: str, value: Any, expire: int = 3600) -> bool:
-#         try:
-#             pickled_value = pickle.dumps(value)
-#             return await self.redis.set(key, pickled_value, ex=expire)
-#         except Exception:
-#             return False
-    
-#     async def delete(self, key: str) -> bool:
-#         return await self.redis.delete(key) > 0
-    
-#     async def get_hash(self, name: str, key: str) -> Optional[Any]:
-#         data = await self.redis.hget(name, key)
-        
-#         if not data:
-#             return None
-            
-#         try:
-#             return pickle.loads(data)
-#         except Exception:
-#             return None
-    
-#     async def set_hash(self, name: str, key: str, value: Any) -> bool:
-#         try:
-#             pickled_value = pickle.dumps(value)
-#             return await self.redis.hset(name, key, pickled_value) > 0
-#         except Exception:
-#             return False
-
-
-
-from aiocache import SimpleMemoryCache
-import pickle
-from typing import Any, Optional
+import asyncio
+import logging
+import math
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.cache.memory import BoundedMemoryCache
+from app.cache.serialization import decode, encode
+from app.core.config import settings
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # pragma: no cover - only needed for CACHE_BACKEND=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# How long another worker's refresh of the same key is trusted to finish
+REFRESH_LOCK_SECONDS = 30
+
 
 class MemcachedClient:
-    
-    def __init__(self):
-        self.cache = SimpleMemoryCache()
-        
-    async def get(self, key: str) -> Optional[Any]:
-        data = await self.cache.get(key)
+    """Two-tier cache: a process-local L1 in front of an optional shared Redis L2.
+
+    With CACHE_BACKEND="memory" only the bounded L1 is used. With "redis",
+    writes go to both tiers and an L1 miss falls through to Redis, filling
+    L1 on a hit. L1 entries live at most CACHE_L1_TTL seconds so writes and
+    deletes made by other workers are picked up quickly. Redis errors are
+    logged and treated as misses, so a Redis outage degrades to L1 only.
+
+    A ready-made client (e.g. fakeredis.FakeAsyncRedis) can be passed in
+    for local testing. Values returned from L1 are shared objects and must
+    not be mutated.
+    """
+
+    def __init__(self, redis_client: Optional[Any] = None):
+        self.cache = BoundedMemoryCache(
+            max_bytes=settings.CACHE_MAX_BYTES,
+            max_entries=settings.CACHE_MAX_ENTRIES
+        )
+        self.redis = redis_client
+        if self.redis is None and settings.CACHE_BACKEND == "redis":
+            if redis is None:
+                logger.warning("CACHE_BACKEND is 'redis' but the redis package is not installed; using the local cache only")
+            else:
+                pool = redis.ConnectionPool(
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    db=settings.REDIS_DB,
+                    password=settings.REDIS_PASSWORD or None,
+                    max_connections=settings.REDIS_MAX_CONNECTIONS
+                )
+                self.redis = redis.Redis(connection_pool=pool, decode_responses=False)
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.fresh_hits = 0
+        self.stale_serves = 0
+        self.early_refreshes = 0
+        self.refreshes = 0
+        self.refreshes_skipped = 0
+        self.refresh_errors = 0
+        self.computes = 0
+
+    @property
+    def backend(self) -> str:
+        return "redis" if self.redis is not None else "memory"
+
+    def _l1_ttl(self, expire: Optional[float]) -> Optional[float]:
+        if self.redis is None:
+            return expire
+        if not expire or expire <= 0:
+            return settings.CACHE_L1_TTL
+        return min(expire, settings.CACHE_L1_TTL)
+
+    def _decode(self, key: str, data: Optional[bytes]) -> Optional[Any]:
         if data is None:
+            self.l2_misses += 1
             return None
         try:
-            return pickle.loads(data)
-        except Exception:
+            value = decode(data)
+        except Exception as e:
+            logger.warning(f"Discarding undecodable cache value for '{key}': {str(e)}")
+            self.l2_misses += 1
+            return None
+        self.l2_hits += 1
+        return value
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.cache.get(key)
+        if value is not None or self.redis is None:
+            return value
+        return await self._get_l2(key)
+
+    async def _get_l2(self, key: str) -> Optional[Any]:
+        """Read key from Redis, bypassing L1, and fill L1 on a hit"""
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.pttl(key)
+                data, ttl_ms = await pipe.execute()
+        except Exception as e:
+            self.l2_errors += 1
+            logger.warning(f"Redis get failed for '{key}': {str(e)}")
             return None
-    
+
+        value = self._decode(key, data)
+        if value is not None:
+            self.cache.set(key, value, ttl=self._l1_ttl(ttl_ms / 1000 if ttl_ms and ttl_ms > 0 else None))
+        return value
+
+    async def mget(self, keys: List[str]) -> List[Optional[Any]]:
+        """Look up several keys with at most one Redis round trip"""
+        values = [self.cache.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if not missing or self.redis is None:
+            return values
+
+        try:
+            found = await self.redis.mget([keys[i] for i in missing])
+        except Exception as e:
+            self.l2_errors += 1
+            logger.warning(f"Redis mget failed for {len(missing)} keys: {str(e)}")
+            return values
+
+        for i, data in zip(missing, found):
+            value = self._decode(keys[i], data)
+            if value is not None:
+                self.cache.set(keys[i], value, ttl=self._l1_ttl(None))
+                values[i] = value
+        return values
+
     async def set(self, key: str, value: Any, expire: int = 3600) -> bool:
         try:
-            pickled_value = pickle.dumps(value)
-            await self.cache.set(key, pickled_value, ttl=expire)
-            return True
+            self.cache.set(key, value, ttl=self._l1_ttl(expire))
         except Exception:
             return False
-    
-    async def delete(self, key: str) -> bool:
+        if self.redis is None:
+            return True
+
         try:
-            await self.cache.delete(key)
+            return bool(await self.redis.set(
+                key, encode(value, settings.CACHE_COMPRESS_MIN_BYTES), ex=expire
+            ))
+        except Exception as e:
+            self.l2_errors += 1
+            logger.warning(f"Redis set failed for '{key}': {str(e)}")
+            return False
+
+    async def set_many(self, items: Dict[str, Any], expire: int = 3600) -> bool:
+        """Write several keys in one pipelined Redis round trip"""
+        for key, value in items.items():
+            self.cache.set(key, value, ttl=self._l1_ttl(expire))
+        if self.redis is None or not items:
             return True
-        except Exception:
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(key, encode(value, settings.CACHE_COMPRESS_MIN_BYTES), ex=expire)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self.l2_errors += 1
+            logger.warning(f"Redis pipelined set of {len(items)} keys failed: {str(e)}")
             return False
 
+    async def delete(self, key: str) -> bool:
+        deleted = self.cache.delete(key)
+        if self.redis is None:
+            return deleted
+
+        try:
+            return await self.redis.delete(key) > 0 or deleted
+        except Exception as e:
+            self.l2_errors += 1
+            logger.warning(f"Redis delete failed for '{key}': {str(e)}")
+            return deleted
+
     async def get_hash(self, name: str, key: str) -> Optional[Any]:
         full_key = f"{name}:{key}"
-        return await self.get(full_key)
-    
+        value = self.cache.get(full_key)
+        if value is not None or self.redis is None:
+            return value
+
+        try:
+            data = await self.redis.hget(name, key)
+        except Exception as e:
+            self.l2_errors += 1
+            logger.warning(f"Redis hget failed for '{full_key}': {str(e)}")
+            return None
+
+        value = self._decode(full_key, data)
+        if value is not None:
+            self.cache.set(full_key, value, ttl=self._l1_ttl(None))
+        return value
+
     async def set_hash(self, name: str, key: str, value: Any) -> bool:
         full_key = f"{name}:{key}"
-        return await self.set(full_key, value)
+        if self.redis is None:
+            return await self.set(full_key, value)
+
+        self.cache.set(full_key, value, ttl=self._l1_ttl(None))
+        try:
+            await self.redis.hset(name, key, encode(value, settings.CACHE_COMPRESS_MIN_BYTES))
+            return True
+        except Exception as e:
+            self.l2_errors += 1
+            logger.warning(f"Redis hset failed for '{full_key}': {str(e)}")
+            return False
+
+    async def put(
+        self,
+        key: str,
+        value: Any,
+        soft_ttl: float,
+        hard_ttl: int,
+        compute_seconds: float = 0.0
+    ) -> bool:
+        """Store value with a soft TTL for get_or_compute; it is dropped after hard_ttl"""
+        entry = {
+            "value": value,
+            "created_at": time.time(),
+            "soft_ttl": soft_ttl,
+            "compute_seconds": compute_seconds,
+        }
+        return await self.set(key, entry, expire=hard_ttl)
+
+    async def get_cached(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        soft_ttl: float,
+        hard_ttl: int,
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ) -> Optional[Any]:
+        """Value stored by put(), or None on a miss; never computes inline.
+
+        An entry past its soft TTL is returned immediately while one
+        background task recomputes it. Before the soft TTL, an entry is
+        refreshed early with probability rising as expiry nears, scaled by
+        how long it took to compute (XFetch), so hot keys do not all expire
+        at once. cacheable can veto storing a result, e.g. a partial one.
+        """
+        entry = await self.get(key)
+        if not isinstance(entry, dict) or "created_at" not in entry:
+            return None
+
+        now = time.time()
+        expires_at = entry["created_at"] + entry["soft_ttl"]
+        if now >= expires_at:
+            self.stale_serves += 1
+            self._refresh(key, entry["created_at"], compute, soft_ttl, hard_ttl, cacheable)
+        else:
+            # XFetch: -log(U) is exponentially distributed, so early refreshes are rare until close to expiry
+            gap = entry["compute_seconds"] * settings.CACHE_XFETCH_BETA * -math.log(1.0 - random.random())
+            if now + gap >= expires_at:
+                self.early_refreshes += 1
+                self._refresh(key, entry["created_at"], compute, soft_ttl, hard_ttl, cacheable)
+            else:
+                self.fresh_hits += 1
+        return entry["value"]
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        soft_ttl: float,
+        hard_ttl: int,
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """Serve key with stale-while-revalidate; see get_cached.
+
+        A missing (or hard-expired) entry is computed inline.
+        """
+        value = await self.get_cached(key, compute, soft_ttl, hard_ttl, cacheable)
+        if value is not None:
+            return value
+
+        self.computes += 1
+        return await self._compute_and_store(key, compute, soft_ttl, hard_ttl, cacheable)
+
+    async def _compute_and_store(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        soft_ttl: float,
+        hard_ttl: int,
+        cacheable: Optional[Callable[[Any], bool]]
+    ) -> Any:
+        started = time.perf_counter()
+        value = await compute()
+        if cacheable is None or cacheable(value):
+            await self.put(key, value, soft_ttl, hard_ttl, time.perf_counter() - started)
+        return value
+
+    def _refresh(
+        self,
+        key: str,
+        stale_created_at: float,
+        compute: Callable[[], Awaitable[Any]],
+        soft_ttl: float,
+        hard_ttl: int,
+        cacheable: Optional[Callable[[Any], bool]]
+    ):
+        if key in self._refreshing:
+            return
+        task = asyncio.ensure_future(self._run_refresh(key, stale_created_at, compute, soft_ttl, hard_ttl, cacheable))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _run_refresh(
+        self,
+        key: str,
+        stale_created_at: float,
+        compute: Callable[[], Awaitable[Any]],
+        soft_ttl: float,
+        hard_ttl: int,
+        cacheable: Optional[Callable[[Any], bool]]
+    ):
+        """Recompute key unless another worker already stored a newer entry.
+
+        The Redis lock only serializes concurrent refreshes, so after taking
+        it the shared entry is re-read: if its created_at is newer than the
+        stale copy this worker served, L1 is filled from it and nothing is
+        recomputed. While another worker holds the lock, the stale L1 copy
+        is evicted so the next request reads the refreshed value from Redis.
+        """
+        lock_key = f"refresh-lock:{key}"
+        if self.redis is not None:
+            # Only one worker refreshes a shared key
+            try:
+                if not await self.redis.set(lock_key, b"1", nx=True, ex=REFRESH_LOCK_SECONDS):
+                    self.cache.delete(key)
+                    return
+            except Exception as e:
+                self.l2_errors += 1
+                logger.warning(f"Redis refresh lock failed for '{key}': {str(e)}")
+            else:
+                current = await self._get_l2(key)
+                if isinstance(current, dict) and current.get("created_at", 0) > stale_created_at:
+                    self.refreshes_skipped += 1
+                    await self._release_refresh_lock(lock_key)
+                    return
+
+        self.refreshes += 1
+        try:
+            await self._compute_and_store(key, compute, soft_ttl, hard_ttl, cacheable)
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.warning(f"Background refresh of '{key}' failed: {str(e)}")
+        finally:
+            await self._release_refresh_lock(lock_key)
+
+    async def _release_refresh_lock(self, lock_key: str):
+        if self.redis is not None:
+            try:
+                await self.redis.delete(lock_key)
+            except Exception:
+                pass
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
 
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.l2_hits + self.l2_misses
+        return {
+            "backend": self.backend,
+            "l1": self.cache.stats(),
+            "l2": {
+                "hits": self.l2_hits,
+                "misses": self.l2_misses,
+                "hit_rate": self.l2_hits / lookups if lookups else 0.0,
+                "errors": self.l2_errors,
+            },
+            "swr": {
+                "fresh_hits": self.fresh_hits,
+                "stale_serves": self.stale_serves,
+                "early_refreshes": self.early_refreshes,
+                "refreshes": self.refreshes,
+                "refreshes_skipped": self.refreshes_skipped,
+                "refreshing": len(self._refreshing),
+                "refresh_errors": self.refresh_errors,
+                "computes": self.computes,
+            },
+        }
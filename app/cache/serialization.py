@@ -0,0 +1,41 @@
+import json
+import zlib
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# One-byte header so readers know how the payload was written
+_PLAIN = b"j"
+_COMPRESSED = b"z"
+
+
+def encode(value: Any, compress_min_bytes: int = 0) -> bytes:
+    """Encode a JSON-like value for storage outside the process.
+
+    Uses orjson when installed and falls back to the standard library.
+    Payloads of at least compress_min_bytes are zlib-compressed; 0 turns
+    compression off.
+    """
+    if orjson is not None:
+        payload = orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        payload = json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    if compress_min_bytes and len(payload) >= compress_min_bytes:
+        return _COMPRESSED + zlib.compress(payload, 1)
+    return _PLAIN + payload
+
+
+def decode(data: bytes) -> Any:
+    header, payload = data[:1], data[1:]
+    if header == _COMPRESSED:
+        payload = zlib.decompress(payload)
+    elif header != _PLAIN:
+        raise ValueError(f"Unknown cache payload header {header!r}")
+
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
@@ -1,20 +1,29 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional
+import asyncio
 import hashlib
+import logging
+import multiprocessing
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..db.session import get_db
 from ..db.models import User
 from .config import settings
 
+logger = logging.getLogger(__name__)
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
 
+# bcrypt is deliberately slow, so it runs in its own processes instead of on the event loop
+_password_executor: Optional[ProcessPoolExecutor] = None
+_password_jobs = 0
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verify that the provided plain password matches the hashed password.
@@ -75,7 +84,65 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 #         print(f"JWT Error: {str(e)}")
 #         raise credentials_exception
     
-def migrate_password_if_needed(db: Session, user: User, plain_password: str) -> None:
+def get_password_executor() -> ProcessPoolExecutor:
+    global _password_executor
+    if _password_executor is None:
+        # Forking a multi-threaded server can copy a lock another thread holds
+        # (e.g. the logging lock passlib takes), so workers come from a forkserver
+        _password_executor = ProcessPoolExecutor(
+            max_workers=settings.PASSWORD_POOL_SIZE,
+            mp_context=multiprocessing.get_context("forkserver")
+        )
+        logger.info(f"Started password hashing pool with {settings.PASSWORD_POOL_SIZE} workers")
+    return _password_executor
+
+def shutdown_password_executor():
+    global _password_executor
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=False, cancel_futures=True)
+        _password_executor = None
+
+async def _run_password_job(fn, *args):
+    """
+    Run a bcrypt job in the password pool. Concurrency is bounded by the
+    pool size; once PASSWORD_QUEUE_LIMIT jobs are running or queued, new
+    ones are refused with 503 instead of piling up.
+    """
+    global _password_jobs
+    if _password_jobs >= settings.PASSWORD_QUEUE_LIMIT:
+        logger.warning(f"Password pool saturated with {_password_jobs} jobs, rejecting request")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent authentication requests, please retry",
+            headers={"Retry-After": "1"},
+        )
+
+    _password_jobs += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_password_executor(), fn, *args)
+    finally:
+        _password_jobs -= 1
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    verify_password, run in the password pool.
+    """
+    return await _run_password_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    get_password_hash, run in the password pool.
+    """
+    return await _run_password_job(get_password_hash, password)
+
+async def hash_passwords_async(passwords: List[str]) -> List[str]:
+    """
+    get_password_hash_async for many passwords at once, within PASSWORD_QUEUE_LIMIT.
+    """
+    return list(await asyncio.gather(*(get_password_hash_async(p) for p in passwords)))
+
+async def migrate_password_if_needed(db: AsyncSession, user: User, plain_password: str) -> None:
     """
     Check if the password is still using the old SHA-256 hash, 
     and if so, upgrade it to bcrypt.
@@ -83,5 +150,5 @@ def migrate_password_if_needed(db: Session, user: User, plain_password: str) ->
     sha256_hash = hashlib.sha256(plain_password.encode()).hexdigest()
     if user.hashed_password == sha256_hash:
         # This is an old SHA-256 hash, upgrade to bcrypt
-        user.hashed_password = get_password_hash(plain_password)
-        db.commit()
+        user.hashed_password = await get_password_hash_async(plain_password)
+        await db.commit()
@@ -0,0 +1,30 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.db.models import Product
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade_schema(engine: Engine):
+    """Add columns introduced after a database was created.
+
+    create_all only creates missing tables, so columns added to existing
+    models are applied here. Safe to run on every start.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(Product.__tablename__):
+        return
+
+    columns = {column["name"] for column in inspector.get_columns(Product.__tablename__)}
+    if "updated_at" not in columns:
+        column_type = Product.__table__.c.updated_at.type.compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {Product.__tablename__} ADD COLUMN updated_at {column_type}"))
+        logger.info("Added products.updated_at")
+
+    for index in Product.__table__.indexes:
+        if "updated_at" in index.columns:
+            index.create(bind=engine, checkfirst=True)
@@ -27,6 +27,7 @@ class Product(Base):
     category_id = Column(Integer, ForeignKey("categories.id"))
     image_url = Column(String(500))
     embedding = Column(Text, nullable=True)  
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), index=True)
     
     category = relationship("Category", back_populates="products")
     feedback = relationship("UserFeedback", back_populates="product")
@@ -22,20 +22,45 @@
 
 # app/db/session.py
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from ..core.config import settings
 
+# Async drivers for the sync URLs in settings
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def async_database_uri(uri: str) -> str:
+    scheme, sep, rest = uri.partition("://")
+    dialect = scheme.split("+")[0]
+    return f"{ASYNC_DRIVERS.get(dialect, scheme)}{sep}{rest}"
+
+# Sync engine for the threadpool crud routes, startup and background index work
 engine = create_engine(
     settings.DATABASE_URI, 
     pool_pre_ping=True,  
-    pool_size=10,  
-    max_overflow=20, 
-    pool_recycle=3600, 
+    pool_size=settings.DB_POOL_SIZE,  
+    max_overflow=settings.DB_MAX_OVERFLOW, 
+    pool_recycle=settings.DB_POOL_RECYCLE, 
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for async def routes, so queries do not block the event loop
+async_engine = create_async_engine(
+    async_database_uri(settings.DATABASE_URI),
+    pool_pre_ping=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+)
+
+# expire_on_commit=False: attribute access after commit would otherwise need implicit IO
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()  
 
 def get_db():
@@ -43,4 +68,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
\ No newline at end of file
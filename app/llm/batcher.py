@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collect prompts arriving within a short window and send them as one request.
+
+    A batch is flushed when ``max_batch_size`` prompts are waiting or
+    ``window_ms`` after the first one arrived, whichever comes first. The
+    batch function returns one completion per prompt, in order, and each
+    caller gets back its own entry.
+    """
+
+    def __init__(
+        self,
+        send_batch: Callable[[List[str]], Awaitable[List[Any]]],
+        window_ms: float,
+        max_batch_size: int
+    ):
+        self.send_batch = send_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+        self.batch_sizes = Counter()
+
+    async def submit(self, prompt: str) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((prompt, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        # Callers that already gave up do not need a completion
+        batch = [(prompt, future) for prompt, future in batch if not future.done()]
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        self.batch_sizes[len(batch)] += 1
+        try:
+            results = await self.send_batch([prompt for prompt, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # Cancelled mid-request (shutdown); callers must not wait on a completion that never comes
+            for _, future in batch:
+                future.cancel()
+            raise
+
+        results = list(results) + [None] * (len(batch) - len(results))
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if result is None:
+                future.set_exception(KeyError("No completion returned for prompt in batch"))
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        batches = sum(self.batch_sizes.values())
+        prompts = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "batches": batches,
+            "prompts": prompts,
+            "mean_batch_size": prompts / batches if batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "pending": len(self._pending),
+        }
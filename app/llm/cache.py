@@ -0,0 +1,87 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+def prompt_key(prompt: str, model: str) -> str:
+    """Hash of the whitespace-normalized prompt and the model name"""
+    normalized = " ".join(prompt.split())
+    return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+def preference_hash(user_preferences: str) -> str:
+    normalized = " ".join(user_preferences.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+class PromptCache:
+    """Bounded LRU of parsed LLM output (rankings, explanations) keyed by prompt hash.
+
+    Entries are tied to the catalog version they were computed against;
+    the whole cache is dropped as soon as a different version is seen.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.catalog_version: Optional[str] = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_version(self, catalog_version: Optional[str]):
+        if catalog_version is None or catalog_version == self.catalog_version:
+            return
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+        self.catalog_version = catalog_version
+
+    def get(
+        self,
+        key: str,
+        catalog_version: Optional[str] = None,
+        accept: Optional[Callable[[Any], bool]] = None
+    ) -> Optional[Any]:
+        """Cached value for key; accept can turn down an entry (counted as a miss) without evicting it"""
+        self._check_version(catalog_version)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        if accept is not None and not accept(entry[0]):
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: str, value: Any, catalog_version: Optional[str] = None):
+        if self.catalog_version is None:
+            self._check_version(catalog_version)
+        elif catalog_version is not None and catalog_version != self.catalog_version:
+            # Computed against a catalog that has since changed
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "catalog_version": self.catalog_version,
+        }
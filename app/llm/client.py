@@ -1,37 +1,131 @@
 import os
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
+import asyncio
 import aiohttp
 import logging
 import json
+import re
 
 from app.core.config import settings
+from app.llm.batcher import MicroBatcher
+from app.llm.cache import PromptCache, preference_hash, prompt_key
 
 logger = logging.getLogger(__name__)
 
+# Rough average for English text with GPT tokenizers; good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, on a word boundary"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return cut.rstrip(" ,.;:-") + "..."
+
 class LLMClient:
     def __init__(self):
         self.api_key = settings.OPENAI_API_KEY
-        self.api_url = "https://api.openai.com/v1/completions"
+        self.api_url = settings.LLM_API_URL
+        self.model = settings.LLM_MODEL_NAME
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self.timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=settings.LLM_CONNECT_TIMEOUT,
+            sock_read=settings.LLM_READ_TIMEOUT
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        self.prompt_cache = PromptCache(
+            max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+            ttl=settings.LLM_CACHE_TTL
+        )
+        self.explanation_cache = PromptCache(
+            max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+            ttl=settings.LLM_CACHE_TTL
+        )
+        self.streams = 0
+        self.streams_stopped_early = 0
+        self.batcher = MicroBatcher(
+            self._post_completions,
+            window_ms=settings.LLM_BATCH_WINDOW_MS,
+            max_batch_size=settings.LLM_MAX_BATCH_SIZE
+        )
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared keep-alive session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.LLM_MAX_CONNECTIONS,
+                limit_per_host=settings.LLM_MAX_CONNECTIONS_PER_HOST,
+                ttl_dns_cache=settings.LLM_DNS_CACHE_TTL,
+                keepalive_timeout=settings.LLM_KEEPALIVE_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=self.timeout
+            )
+        return self._session
+
+    async def close(self):
+        """Close the pooled session; called on application shutdown"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
     
     async def generate_recommendations(
         self, 
         user_preferences: str,
         product_descriptions: List[Dict[str, Any]],
-        top_k: int = 5
+        top_k: int = 5,
+        catalog_version: Optional[str] = None
     ) -> List[Dict[str, Any]]:
-        """Generate product recommendations using LLM"""
+        """Generate product recommendations using LLM
         
-        prompt = self._create_recommendation_prompt(user_preferences, product_descriptions)
+        The parsed ranking is cached by prompt hash and model, so repeated
+        prompts against the same catalog version skip the upstream call.
+        With LLM_STREAMING_ENABLED the completion is streamed and abandoned
+        as soon as top_k valid product IDs have been read; such truncated
+        rankings are only reused for callers asking for as many or fewer.
+        """
+        
+        prompt, prompt_ids = self._create_recommendation_prompt(user_preferences, product_descriptions)
+        cache_key = prompt_key(prompt, self.model)
+        # Only products that made it into the prompt can be ranked
+        valid_ids = set(prompt_ids)
+        wanted = min(top_k, len(valid_ids))
         
         try:
-            logger.info(f"Generating LLM recommendations based on: {user_preferences[:100]}...")
-            response = await self._call_llm_api(prompt)
+            product_ids = None
+            # A truncated ranking only serves callers wanting as many IDs as it holds
+            cached = self.prompt_cache.get(
+                cache_key,
+                catalog_version,
+                accept=lambda entry: entry[1] or len(valid_ids.intersection(entry[0])) >= wanted
+            )
+            if cached is not None:
+                product_ids = cached[0]
+            
+            if product_ids is None:
+                logger.info(f"Generating LLM recommendations based on: {user_preferences[:100]}...")
+                if settings.LLM_STREAMING_ENABLED:
+                    product_ids, complete = await self._stream_product_ids(prompt, valid_ids, wanted)
+                else:
+                    response = await self._call_llm_api(prompt)
+                    product_ids, complete = self._parse_product_ids(response), True
+                if product_ids:
+                    self.prompt_cache.set(cache_key, (product_ids, complete), catalog_version)
+            else:
+                logger.info(f"Using cached LLM ranking for: {user_preferences[:100]}...")
             
-            recommended_products = self._parse_recommendations(response, product_descriptions)
+            recommended_products = self._build_recommendations(product_ids, product_descriptions)
             
             logger.info(f"Generated {len(recommended_products)} LLM recommendations")
             return recommended_products[:top_k]
@@ -39,23 +133,47 @@ class LLMClient:
             logger.error(f"Error generating LLM recommendations: {str(e)}")
             
             logger.info("Using fallback recommendations")
-            return product_descriptions[:min(top_k, len(product_descriptions))]
+            return [p.copy() for p in product_descriptions[:min(top_k, len(product_descriptions))]]
     
     async def _call_llm_api(self, prompt: str) -> str:
-        """Make API call to OpenAI"""
+        """Make API call to OpenAI
+        
+        With LLM_BATCHING_ENABLED, concurrent prompts are micro-batched into
+        a single completions request.
+        """
+        if settings.LLM_BATCHING_ENABLED:
+            return await self.batcher.submit(prompt)
+        return (await self._post_completions([prompt]))[0]
+    
+    async def _post_completions(self, prompts: List[str]) -> List[Optional[str]]:
+        """POST one completions request and return the texts in prompt order"""
         payload = {
-            "model": "gpt-3.5-turbo-instruct",
-            "prompt": prompt,
-            "max_tokens": 500,
+            "model": self.model,
+            "prompt": prompts[0] if len(prompts) == 1 else prompts,
+            "max_tokens": settings.LLM_MAX_TOKENS,
             "temperature": 0.7
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, headers=self.headers, json=payload) as response:
+            session = await self._get_session()
+            # Cap in-flight upstream calls so bursts queue here instead of at the API
+            async with self._semaphore:
+                async with session.post(self.api_url, json=payload) as response:
                     response.raise_for_status()
                     result = await response.json()
-                    return result["choices"][0]["text"]
+            
+            # Choices carry the index of the prompt they answer
+            texts: List[Optional[str]] = [None] * len(prompts)
+            for position, choice in enumerate(result["choices"]):
+                index = choice.get("index", position)
+                if 0 <= index < len(prompts) and texts[index] is None:
+                    texts[index] = choice["text"]
+            if len(prompts) == 1 and texts[0] is None:
+                raise KeyError("text")
+            return texts
+        except asyncio.TimeoutError:
+            logger.error("API request timed out")
+            raise
         except aiohttp.ClientError as e:
             logger.error(f"API request error: {str(e)}")
             raise
@@ -63,29 +181,88 @@ class LLMClient:
             logger.error(f"Unexpected API response format: {str(e)}")
             raise
     
+    async def _stream_product_ids(
+        self,
+        prompt: str,
+        valid_ids: set,
+        top_k: int
+    ) -> Tuple[List[int], bool]:
+        """Stream a completion and parse product IDs as they arrive
+        
+        Returns the IDs read so far and whether the completion was read to
+        the end. Once top_k distinct valid IDs are known the connection is
+        closed, which stops generation (and billing) upstream.
+        """
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": settings.LLM_MAX_TOKENS,
+            "temperature": 0.7,
+            "stream": True
+        }
+        
+        text = ""
+        self.streams += 1
+        try:
+            session = await self._get_session()
+            async with self._semaphore:
+                async with session.post(self.api_url, json=payload) as response:
+                    response.raise_for_status()
+                    # Server-sent events: one "data: {...}" line per chunk
+                    async for raw_line in response.content:
+                        line = raw_line.decode("utf-8").strip()
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        choices = json.loads(data).get("choices") or []
+                        if choices:
+                            text += choices[0].get("text") or ""
+                        
+                        # A trailing number may still be growing, so only count terminated ones
+                        product_ids = [int(m) for m in re.findall(r"\d+(?=\D)", text)]
+                        if len(valid_ids.intersection(product_ids)) >= top_k:
+                            response.close()
+                            self.streams_stopped_early += 1
+                            return product_ids, False
+        except asyncio.TimeoutError:
+            logger.error("Streaming API request timed out")
+            raise
+        except aiohttp.ClientError as e:
+            logger.error(f"Streaming API request error: {str(e)}")
+            raise
+        
+        return [int(m) for m in re.findall(r"\d+", text)], True
+    
+    def stream_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.LLM_STREAMING_ENABLED,
+            "streams": self.streams,
+            "stopped_early": self.streams_stopped_early,
+        }
+    
     def _create_recommendation_prompt(
         self, 
         user_preferences: str,
         product_descriptions: List[Dict[str, Any]]
-    ) -> str:
-        """Create a detailed prompt for the LLM"""
+    ) -> Tuple[str, List[int]]:
+        """Create a prompt for the LLM that fits LLM_PROMPT_TOKEN_BUDGET
         
-        # Convert product list to a string with complete details
-        products_text = "\n".join([
-            f"Product {i+1} (ID: {p['id']}): {p['name']} - {p['description']} - " + 
-            f"Category: {p['category']} - Price: {p['price']} - Brand: {p.get('brand', 'Unknown')}"
-            for i, p in enumerate(product_descriptions[:50])  # Limit to first 50 to keep prompt size reasonable
-        ])
+        Products are expected in relevance order (the candidates retrieved
+        from the content-based index); lines are added until the budget is
+        spent, with descriptions truncated and default fields left out.
+        Returns the prompt and the ids of the products it includes.
+        """
         
-        # Build a detailed prompt
-        prompt = f"""
+        header = f"""
 You are a personalized product recommendation engine for an e-commerce platform.
 
 Customer preferences: {user_preferences}
 
 Available products:
-{products_text}
-
+"""
+        footer = """
 Based on the customer preferences and available products, recommend the most suitable products.
 Consider product categories, descriptions, brands, and any specific needs mentioned by the customer.
 Rank products from most to least relevant.
@@ -94,61 +271,77 @@ Format your answer as a simple comma-separated list of product IDs (numbers only
 Example: 3, 17, 42, 9, 21
 """
         
-        return prompt
+        remaining = settings.LLM_PROMPT_TOKEN_BUDGET - estimate_tokens(header) - estimate_tokens(footer)
+        product_lines = []
+        product_ids = []
+        for p in product_descriptions:
+            line = self._format_product_line(p)
+            cost = estimate_tokens(line) + 1
+            if cost > remaining:
+                break
+            product_lines.append(line)
+            product_ids.append(p['id'])
+            remaining -= cost
+        
+        if len(product_lines) < len(product_descriptions):
+            logger.info(f"Prompt budget fits {len(product_lines)} of {len(product_descriptions)} candidate products")
+        
+        return header + "\n".join(product_lines) + "\n" + footer, product_ids
     
-    def _parse_recommendations(
-        self, 
-        llm_response: str,
+    def _format_product_line(self, p: Dict[str, Any]) -> str:
+        """Compact one-line product summary for the prompt"""
+        description = truncate_to_tokens(" ".join((p.get('description') or "").split()), settings.LLM_DESCRIPTION_MAX_TOKENS)
+        
+        parts = [f"ID {p['id']}: {p['name']}"]
+        if description:
+            parts.append(description)
+        parts.append(f"Category: {p['category']}")
+        price = p['price']
+        parts.append(f"Price: {price:.2f} USD" if isinstance(price, (int, float)) else f"Price: {price}")
+        if p.get('brand') and p['brand'] != 'Unknown':
+            parts.append(f"Brand: {p['brand']}")
+        return " - ".join(parts)
+    
+    def _parse_product_ids(self, llm_response: str) -> List[int]:
+        """Extract the ranked product IDs from an LLM response"""
+        cleaned_response = llm_response.strip()
+        
+        product_ids = []
+        if ',' in cleaned_response:
+            for part in cleaned_response.split(','):
+                try:
+                    product_ids.append(int(part.strip()))
+                except ValueError:
+                    continue
+        else:
+            for line in cleaned_response.split('\n'):
+                stripped_line = line.strip()
+                if stripped_line.isdigit():
+                    product_ids.append(int(stripped_line))
+        
+        return product_ids
+    
+    def _build_recommendations(
+        self,
+        product_ids: List[int],
         product_descriptions: List[Dict[str, Any]]
     ) -> List[Dict[str, Any]]:
-        """Parse LLM response and return recommended products"""
+        """Map a ranked list of product IDs onto catalog products"""
         
         # Create ID to product mapping for faster lookups
         product_map = {p['id']: p for p in product_descriptions}
         
-        try:
-           
-            cleaned_response = llm_response.strip()
-            
-            if ',' in cleaned_response:
-                product_ids = []
-                for part in cleaned_response.split(','):
-                    try:
-                        pid = int(part.strip())
-                        product_ids.append(pid)
-                    except ValueError:
-                        
-                        continue
-            else:
-               
-                product_ids = []
-                for line in cleaned_response.split('\n'):
-                    try:
-                      
-                        stripped_line = line.strip()
-                        if stripped_line.isdigit():
-                            pid = int(stripped_line)
-                            product_ids.append(pid)
-                    except ValueError:
-                        continue
-            
-           
-            recommendations = []
-            for pid in product_ids:
-                if pid in product_map:
-                    product = product_map[pid].copy()
-                    
-                    product['reason'] = "Recommended by AI based on your preferences."
-                    
-                    product['match_score'] = 95 - (product_ids.index(pid) * 5) 
-                    recommendations.append(product)
-            
-            return recommendations
-            
-        except Exception as e:
-            logger.error(f"Error parsing LLM recommendations: {str(e)}")
-            # Fallback to returning the first few products
-            return product_descriptions[:5]
+        recommendations = []
+        for pid in product_ids:
+            if pid in product_map:
+                product = product_map[pid].copy()
+                
+                product['reason'] = "Recommended by AI based on your preferences."
+                
+                product['match_score'] = 95 - (product_ids.index(pid) * 5) 
+                recommendations.append(product)
+        
+        return recommendations
     
     async def generate_product_explanation(
         self,
@@ -156,23 +349,92 @@ Example: 3, 17, 42, 9, 21
         user_preferences: str
     ) -> str:
         """Generate personalized explanation for why a product is recommended"""
+        explanations = await self.generate_product_explanations([product], user_preferences)
+        return explanations[product['id']]
+    
+    async def generate_product_explanations(
+        self,
+        products: List[Dict[str, Any]],
+        user_preferences: str,
+        catalog_version: Optional[str] = None
+    ) -> Dict[int, str]:
+        """Explain a page of recommendations with a single LLM call
         
-        prompt = f"""
-Product: {product['name']}
-Description: {product['description']}
-Category: {product['category']}
-Brand: {product.get('brand', 'Unknown')}
-Price: {product['price']}
-
+        Explanations are cached per (product id, preference hash); only the
+        uncached products go into the prompt. Those are split into groups
+        whose answers fit LLM_MAX_TOKENS at LLM_EXPLANATION_TOKENS each;
+        the groups are submitted together, so the batcher still sends them
+        upstream as one request. Products the response does not cover get
+        the generic fallback sentence.
+        """
+        pref_hash = preference_hash(user_preferences)
+        explanations: Dict[int, str] = {}
+        missing = []
+        for product in products:
+            cached = self.explanation_cache.get(f"{product['id']}:{pref_hash}", catalog_version)
+            if cached is not None:
+                explanations[product['id']] = cached
+            else:
+                missing.append(product)
+        
+        if not missing:
+            return explanations
+        
+        group_size = max(settings.LLM_MAX_TOKENS // settings.LLM_EXPLANATION_TOKENS, 1)
+        groups = [missing[i:i + group_size] for i in range(0, len(missing), group_size)]
+        responses = await asyncio.gather(
+            *(self._call_llm_api(self._create_explanation_prompt(group, user_preferences)) for group in groups),
+            return_exceptions=True
+        )
+        
+        parsed: Dict[int, str] = {}
+        for response in responses:
+            if isinstance(response, Exception):
+                logger.error(f"Error generating product explanations: {str(response)}")
+                continue
+            parsed.update(self._parse_explanations(response))
+        
+        for product in missing:
+            explanation = parsed.get(product['id'])
+            if explanation:
+                self.explanation_cache.set(f"{product['id']}:{pref_hash}", explanation, catalog_version)
+            else:
+                explanation = f"This {product['category']} product matches your preferences."
+            explanations[product['id']] = explanation
+        
+        return explanations
+    
+    def _create_explanation_prompt(
+        self,
+        products: List[Dict[str, Any]],
+        user_preferences: str
+    ) -> str:
+        products_text = "\n".join(self._format_product_line(p) for p in products)
+        
+        return f"""
 Customer preferences: {user_preferences}
 
-In 2-3 sentences, explain why this product would be a good match for this customer. 
+Products:
+{products_text}
+
+For each product, explain in 2-3 sentences why it would be a good match for this customer.
 Focus on how the product features align with their preferences.
+
+Answer with exactly one line per product, in this format:
+ID <product id>: <explanation>
 """
+    
+    def _parse_explanations(self, llm_response: str) -> Dict[int, str]:
+        """Split a batched response into per-product explanations"""
+        explanations: Dict[int, List[str]] = {}
+        current = None
+        for line in llm_response.splitlines():
+            match = re.match(r"^\s*(?:product\s*)?(?:id\s*)?#?(\d+)\s*[:.)\-]\s*(.*)$", line, re.IGNORECASE)
+            if match:
+                current = int(match.group(1))
+                explanations[current] = [match.group(2).strip()]
+            elif current is not None and line.strip():
+                # Continuation of a wrapped explanation
+                explanations[current].append(line.strip())
         
-        try:
-            explanation = await self._call_llm_api(prompt)
-            return explanation.strip()
-        except Exception as e:
-            logger.error(f"Error generating product explanation: {str(e)}")
-            return f"This {product['category']} product matches your preferences."
\ No newline at end of file
+        return {pid: " ".join(parts).strip() for pid, parts in explanations.items() if any(parts)}
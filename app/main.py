@@ -1,16 +1,21 @@
 import logging
 import os
+from typing import List
 from fastapi import FastAPI, Depends, HTTPException
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 import uvicorn
 
 from app.api import auth, recommendation, feedback, crud
 from app.core.config import settings
-from app.core.security import get_password_hash
+from app.core.security import get_password_executor, hash_passwords_async, shutdown_password_executor
 from app.db.session import engine, SessionLocal
 from app.db.base import Base
+from app.db.migrate import upgrade_schema
 from app.db.models import User, Product, Category, UserPreference, UserFeedback
+from app.recommender.executor import get_executor, shutdown_executor, uses_process_pool
+from app.recommender.index import recommender
 
 # Third-party libraries for generating fake data
 from faker import Faker
@@ -22,6 +27,7 @@ logger = logging.getLogger(__name__)
 
 # Create tables if they don't exist
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 app = FastAPI(
     title="Product Recommendation System", 
@@ -36,6 +42,7 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "X-Partial-Results"],
     )
 
 # Mount routers
@@ -44,6 +51,50 @@ app.include_router(recommendation.router, prefix="/api/products", tags=["recomme
 app.include_router(feedback.router, prefix="/api/feedback", tags=["feedback"])
 app.include_router(crud.router, prefix="/api/crud", tags=["crud"])
 
+@app.on_event("startup")
+def start_worker_pools():
+    """Create the process pools before request threads exist"""
+    get_password_executor()
+    if uses_process_pool():
+        get_executor()
+
+@app.on_event("startup")
+async def auto_populate_database():
+    """Fill an empty database with sample data when AUTO_POPULATE_DB is set"""
+    if os.environ.get("AUTO_POPULATE_DB", "false").lower() != "true":
+        return
+    try:
+        await populate_sample_data()
+    except Exception as e:
+        logger.error(f"Failed to auto-populate database: {e}")
+
+@app.on_event("startup")
+def build_recommendation_index():
+    """Load or fit the recommendation index once so requests only score queries"""
+    db = SessionLocal()
+    try:
+        recommender.start(db)
+    except Exception as e:
+        logger.error(f"Failed to build recommendation index: {e}")
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await recommendation.llm_client.close()
+
+@app.on_event("shutdown")
+async def close_cache_client():
+    await recommendation.redis_client.close()
+
+@app.on_event("shutdown")
+def stop_recommender_pool():
+    shutdown_executor()
+
+@app.on_event("shutdown")
+def stop_password_pool():
+    shutdown_password_executor()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Product Recommendation System API"}
@@ -56,13 +107,20 @@ async def health_check():
 async def populate_database():
     """Endpoint to populate the database with sample data"""
     try:
-        create_sample_data()
+        await populate_sample_data()
+        recommender.invalidate()
+        await recommendation.catalog_generation.bump()
         return {"message": "Database populated successfully"}
     except Exception as e:
         logger.error(f"Error populating database: {e}")
         raise HTTPException(status_code=500, detail=f"Error populating database: {str(e)}")
 
-def create_sample_data():
+async def populate_sample_data():
+    """Hash in the password pool without blocking the loop, then write from the threadpool"""
+    hashed_passwords = await hash_passwords_async([f"password{i}" for i in range(5)])
+    await run_in_threadpool(create_sample_data, hashed_passwords)
+
+def create_sample_data(hashed_passwords: List[str]):
     """Function to add sample data to the database"""
     db = SessionLocal()
     fake = Faker()
@@ -81,12 +139,10 @@ def create_sample_data():
         # Generate 5 users
         users = []
         for i in range(5):
-            # Use bcrypt hashing via security module
-            hashed_password = get_password_hash(f"password{i}")
             user = User(
                 username=fake.user_name(),
                 email=fake.email(),
-                hashed_password=hashed_password,
+                hashed_password=hashed_passwords[i],
                 is_active=True,
                 created_at=datetime.now() - timedelta(days=random.randint(1, 365))
             )
@@ -176,12 +232,5 @@ def create_sample_data():
     finally:
         db.close()
 
-# Auto-populate database on startup if environment variable is set
-if os.environ.get("AUTO_POPULATE_DB", "false").lower() == "true":
-    try:
-        create_sample_data()
-    except Exception as e:
-        logger.error(f"Failed to auto-populate database: {e}")
-
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
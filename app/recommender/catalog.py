@@ -0,0 +1,365 @@
+import logging
+import sys
+import threading
+import time
+from collections.abc import Sequence
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from app.core.config import settings
+from app.db.models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+
+def catalog_version_select() -> Select:
+    """Aggregates behind the catalog version; works with the sync and the async session"""
+    return select(func.count(Product.id), func.max(Product.id), func.max(Product.updated_at))
+
+
+def format_catalog_version(count: int, max_id: Optional[int], last_update) -> str:
+    return f"{count}:{max_id or 0}:{last_update or ''}"
+
+
+def get_catalog_version(db: Session) -> str:
+    """Cheap fingerprint of the catalog used to decide when the index is stale"""
+    return format_catalog_version(*db.execute(catalog_version_select()).one())
+
+
+class StringTable:
+    """Append-only pool of distinct strings addressed by int32 codes.
+
+    Code 0 is reserved for None. Repeated values (category-style
+    descriptions, shared names) are stored once however many rows use them.
+    """
+
+    def __init__(self):
+        self.values: List[Optional[str]] = [None]
+        self._codes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        code = self._codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(value)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(value)
+                    self._codes[value] = code
+        return code
+
+    def codes(self, values: Iterable[Optional[str]]) -> np.ndarray:
+        return np.fromiter((self.code(v) for v in values), dtype=np.int32)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            sys.getsizeof(self.values)
+            + sys.getsizeof(self._codes)
+            + sum(sys.getsizeof(v) for v in self.values if v is not None)
+        )
+
+
+class CatalogColumns(Sequence):
+    """Immutable columnar catalog; rows decode to the usual product dicts on access.
+
+    Refreshes and incremental index updates build a new instance instead of
+    mutating one, so a reader holding a reference always sees one version.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        prices: np.ndarray,
+        category_ids: np.ndarray,
+        names: np.ndarray,
+        descriptions: np.ndarray,
+        image_urls: np.ndarray,
+        strings: StringTable,
+        categories: Dict[int, str]
+    ):
+        self.ids = ids
+        self.prices = prices
+        self.category_ids = category_ids
+        self.names = names
+        self.descriptions = descriptions
+        self.image_urls = image_urls
+        self.strings = strings
+        self.categories = categories
+
+    @classmethod
+    def from_products(
+        cls,
+        products: Iterable[Dict[str, Any]],
+        strings: Optional[StringTable] = None,
+        categories: Optional[Dict[int, str]] = None
+    ) -> "CatalogColumns":
+        """Columns for product dicts, which carry a category name rather than an id"""
+        products = list(products)
+        strings = strings or StringTable()
+        categories = dict(categories or {})
+        category_codes = {name: cid for cid, name in categories.items()}
+
+        def category_id(name):
+            # Names missing from the category table get negative ids of their own
+            if name is None:
+                return -1
+            if name not in category_codes:
+                category_codes[name] = -2 - len(category_codes)
+                categories[category_codes[name]] = name
+            return category_codes[name]
+
+        return cls(
+            ids=np.array([p["id"] for p in products], dtype=np.int64),
+            prices=np.array([np.nan if p["price"] is None else p["price"] for p in products], dtype=np.float64),
+            category_ids=np.array([category_id(p["category"]) for p in products], dtype=np.int64),
+            names=strings.codes(p["name"] for p in products),
+            descriptions=strings.codes(p.get("description") for p in products),
+            image_urls=strings.codes(p.get("image_url") for p in products),
+            strings=strings,
+            categories=categories,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def name(self, row: int) -> Optional[str]:
+        return self.strings.values[self.names[row]]
+
+    def description(self, row: int) -> Optional[str]:
+        return self.strings.values[self.descriptions[row]]
+
+    def category(self, row: int) -> Optional[str]:
+        return self.categories.get(int(self.category_ids[row]))
+
+    def price(self, row: int) -> Optional[float]:
+        price = float(self.prices[row])
+        return None if np.isnan(price) else price
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        return {
+            "id": int(self.ids[row]),
+            "name": self.name(row),
+            "description": self.description(row),
+            "price": self.price(row),
+            "category": self.category(row),
+            "image_url": self.strings.values[self.image_urls[row]],
+            "brand": "Unknown",
+            "reviews_count": 0
+        }
+
+    def texts(self) -> List[str]:
+        """TF-IDF input per row, built without decoding whole products"""
+        values = self.strings.values
+        return [
+            f"{values[name]} {values[description]} {self.categories.get(category_id)}"
+            for name, description, category_id in zip(
+                self.names.tolist(), self.descriptions.tolist(), self.category_ids.tolist()
+            )
+        ]
+
+    def take(self, rows: np.ndarray) -> "CatalogColumns":
+        return CatalogColumns(
+            ids=self.ids[rows],
+            prices=self.prices[rows],
+            category_ids=self.category_ids[rows],
+            names=self.names[rows],
+            descriptions=self.descriptions[rows],
+            image_urls=self.image_urls[rows],
+            strings=self.strings,
+            categories=self.categories,
+        )
+
+    def concat(self, other: "CatalogColumns") -> "CatalogColumns":
+        """Rows of self followed by rows of other; both must share one string table"""
+        return CatalogColumns(
+            ids=np.concatenate([self.ids, other.ids]),
+            prices=np.concatenate([self.prices, other.prices]),
+            category_ids=np.concatenate([self.category_ids, other.category_ids]),
+            names=np.concatenate([self.names, other.names]),
+            descriptions=np.concatenate([self.descriptions, other.descriptions]),
+            image_urls=np.concatenate([self.image_urls, other.image_urls]),
+            strings=self.strings,
+            categories={**self.categories, **other.categories},
+        )
+
+    def extend(self, products: List[Dict[str, Any]]) -> "CatalogColumns":
+        return self.concat(CatalogColumns.from_products(products, self.strings, self.categories))
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the per-row arrays; the shared string table is reported separately"""
+        return sum(
+            column.nbytes for column in
+            (self.ids, self.prices, self.category_ids, self.names, self.descriptions, self.image_urls)
+        )
+
+
+class CatalogStore:
+    """Process-wide columnar copy of the catalog, kept current by delta queries.
+
+    The first refresh loads every product. Later refreshes only read rows
+    whose updated_at is at or after the database time of the previous
+    refresh, minus CATALOG_REFRESH_OVERLAP_SECONDS for coarse clocks and
+    transactions that commit late. They also compare the id column to find deletions and inserts that slipped past
+    the timestamp, and reload the small category table so renames apply to
+    every row at once. Columns are kept sorted by id for lookups.
+
+    Strings orphaned by edits stay in the pool until the next full load.
+    """
+
+    def __init__(self):
+        self.columns: Optional[CatalogColumns] = None
+        self.version: Optional[str] = None
+        self.watermark = None
+        self._stale = False
+        self._lock = threading.Lock()
+        self.full_loads = 0
+        self.delta_refreshes = 0
+        self.delta_rows = 0
+        self.deleted_rows = 0
+        self.last_refresh_seconds: Optional[float] = None
+
+    def mark_stale(self):
+        """Refresh on the next call even if the catalog fingerprint looks unchanged"""
+        self._stale = True
+
+    def refresh(self, db: Session, catalog_version: Optional[str] = None) -> bool:
+        """Bring the columns up to catalog_version; returns False when already current"""
+        with self._lock:
+            catalog_version = catalog_version or get_catalog_version(db)
+            if self.columns is not None and catalog_version == self.version and not self._stale:
+                return False
+            self._stale = False
+
+            started = time.perf_counter()
+            refreshed_at = db.execute(select(func.now())).scalar()
+            if self.columns is None:
+                columns = self._load_full(db)
+            else:
+                columns = self._load_delta(db, self.columns)
+
+            self.columns = columns
+            self.version = catalog_version
+            self.watermark = refreshed_at
+            self.last_refresh_seconds = time.perf_counter() - started
+            return True
+
+    def _select(self):
+        return select(
+            Product.id,
+            Product.name,
+            Product.description,
+            Product.price,
+            Product.category_id,
+            Product.image_url,
+        ).order_by(Product.id)
+
+    def _build(self, rows, strings: StringTable, categories: Dict[int, str]) -> CatalogColumns:
+        ids, prices, category_ids, names, descriptions, image_urls = [], [], [], [], [], []
+        code = strings.code
+        for pid, name, description, price, category_id, image_url in rows:
+            ids.append(pid)
+            prices.append(np.nan if price is None else price)
+            category_ids.append(-1 if category_id is None else category_id)
+            names.append(code(name))
+            descriptions.append(code(description))
+            image_urls.append(code(image_url))
+        return CatalogColumns(
+            ids=np.array(ids, dtype=np.int64),
+            prices=np.array(prices, dtype=np.float64),
+            category_ids=np.array(category_ids, dtype=np.int64),
+            names=np.array(names, dtype=np.int32),
+            descriptions=np.array(descriptions, dtype=np.int32),
+            image_urls=np.array(image_urls, dtype=np.int32),
+            strings=strings,
+            categories=categories,
+        )
+
+    def _load_categories(self, db: Session) -> Dict[int, str]:
+        return dict(db.execute(select(Category.id, Category.name)).all())
+
+    def _load_full(self, db: Session) -> CatalogColumns:
+        categories = self._load_categories(db)
+        rows = db.execute(self._select().execution_options(yield_per=settings.CATALOG_LOAD_BATCH_SIZE))
+        columns = self._build(rows, StringTable(), categories)
+
+        self.full_loads += 1
+        logger.info(f"Loaded {len(columns)} products into the catalog store")
+        return columns
+
+    def _load_delta(self, db: Session, current: CatalogColumns) -> CatalogColumns:
+        categories = self._load_categories(db)
+        changed = []
+        if self.watermark is not None:
+            since = self.watermark - timedelta(seconds=settings.CATALOG_REFRESH_OVERLAP_SECONDS)
+            changed = list(db.execute(self._select().where(Product.updated_at >= since)))
+
+        live_ids = np.fromiter(db.execute(select(Product.id)).scalars(), dtype=np.int64)
+        changed_ids = np.array([row.id for row in changed], dtype=np.int64)
+        keep = np.isin(current.ids, live_ids) & ~np.isin(current.ids, changed_ids)
+        deleted = int((~np.isin(current.ids, live_ids)).sum())
+
+        # Rows without a usable timestamp are still found by their id
+        missing = np.setdiff1d(live_ids, np.concatenate([current.ids[keep], changed_ids]))
+        if len(missing):
+            changed += list(db.execute(self._select().where(Product.id.in_(missing.tolist()))))
+
+        delta = self._build(changed, current.strings, categories)
+        columns = current.take(np.flatnonzero(keep)).concat(delta)
+        columns.categories = categories
+        columns = columns.take(np.argsort(columns.ids, kind="stable"))
+
+        self.delta_refreshes += 1
+        self.delta_rows += len(changed)
+        self.deleted_rows += deleted
+        logger.info(f"Refreshed catalog store: {len(changed)} changed, {deleted} deleted, {len(columns)} products")
+        return columns
+
+    def fetch(self, db: Session, product_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """Read the given products straight from the database, leaving the store untouched"""
+        rows = db.execute(self._select().where(Product.id.in_(list(product_ids))))
+        return list(self._build(rows, StringTable(), self._load_categories(db)))
+
+    def get_many(self, product_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """Products for the given ids in the order asked, skipping unknown ids"""
+        columns = self.columns
+        if columns is None or not len(columns):
+            return []
+        product_ids = np.asarray(list(product_ids), dtype=np.int64)
+        rows = np.minimum(np.searchsorted(columns.ids, product_ids), len(columns) - 1)
+        return [columns[row] for row, found in zip(rows, columns.ids[rows] == product_ids) if found]
+
+    def stats(self) -> Dict[str, Any]:
+        columns = self.columns
+        return {
+            "version": self.version,
+            "products": len(columns) if columns is not None else 0,
+            "strings": len(columns.strings) if columns is not None else 0,
+            "column_bytes": columns.nbytes if columns is not None else 0,
+            "string_bytes": columns.strings.nbytes if columns is not None else 0,
+            "full_loads": self.full_loads,
+            "delta_refreshes": self.delta_refreshes,
+            "delta_rows": self.delta_rows,
+            "deleted_rows": self.deleted_rows,
+            "last_refresh_seconds": self.last_refresh_seconds,
+        }
+
+
+catalog_store = CatalogStore()
@@ -0,0 +1,379 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.models import Product
+from app.recommender.snapshot import current_generation, new_generation, publish_generation
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_FORMAT = 1
+
+
+def parse_embedding(text: Optional[str]) -> Optional[np.ndarray]:
+    """Parse the legacy comma-joined text format stored in Product.embedding"""
+    if not text:
+        return None
+    try:
+        return np.array(text.split(","), dtype=np.float32)
+    except ValueError:
+        return None
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _spherical_kmeans(x: np.ndarray, k: int, iterations: int, seed: int = 0) -> np.ndarray:
+    """Train k unit-norm centroids on normalized rows of x"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, x)
+        counts = np.bincount(assignments, minlength=k)
+        # Re-seed empty clusters from random points so every list stays usable
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = x[rng.choice(len(x), size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class EmbeddingState(NamedTuple):
+    """One consistent view of the index; refreshes publish a new one instead of mutating it"""
+    ids: np.ndarray
+    vectors: np.ndarray
+    centroids: Optional[np.ndarray]
+    list_rows: np.ndarray
+    list_offsets: np.ndarray
+    # Rows added since the build; row n of the index is extra row n - len(ids)
+    extra_ids: np.ndarray
+    extra_vectors: np.ndarray
+    alive: np.ndarray
+    row_by_id: Dict[int, int]
+
+    @classmethod
+    def from_build(
+        cls,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        centroids: Optional[np.ndarray] = None,
+        list_rows: Optional[np.ndarray] = None,
+        list_offsets: Optional[np.ndarray] = None
+    ) -> "EmbeddingState":
+        return cls(
+            ids=ids,
+            vectors=vectors,
+            centroids=centroids,
+            list_rows=list_rows if list_rows is not None else np.zeros(0, dtype=np.int64),
+            list_offsets=list_offsets if list_offsets is not None else np.zeros(1, dtype=np.int64),
+            extra_ids=np.zeros(0, dtype=np.int64),
+            extra_vectors=np.zeros((0, vectors.shape[1]), dtype=np.float32),
+            alive=np.ones(len(ids), dtype=bool),
+            row_by_id={int(pid): row for row, pid in enumerate(ids)},
+        )
+
+    def vector(self, row: int) -> np.ndarray:
+        if row < len(self.ids):
+            return np.asarray(self.vectors[row])
+        return self.extra_vectors[row - len(self.ids)]
+
+    def changed_rows(self) -> int:
+        """Rows changed since the build; an edit both masks a base row and adds a side row"""
+        return max(int(len(self.ids) - self.alive[:len(self.ids)].sum()), len(self.extra_ids))
+
+
+class EmbeddingIndex:
+    """Side-car float32 embedding matrix with an IVF approximate-nearest-neighbour search.
+
+    A full build bulk-loads Product.embedding, trains the IVF cells and
+    writes ``ids.npy``/``vectors.npy`` plus the cell lists into a new
+    generation directory under MODEL_OUTPUT_DIR, made current with
+    os.replace like the recommender snapshots, so readers never pair ids
+    with vectors from another build. Later starts memory-map the current
+    generation and catch up from the database time it was built at.
+
+    Catalog writes are applied as deltas, the way CatalogStore refreshes:
+    changed rows are masked out of the base matrix and appended to a small
+    side matrix that every query scans exactly. Once the changes exceed
+    EMBEDDING_REBUILD_FRACTION of the rows, the next refresh rebuilds and
+    retrains. Queries probe only the ``nprobe`` closest k-means cells of
+    the base matrix; raising ``nprobe`` trades latency for recall.
+
+    Refreshes run on executor threads while queries are served, so all
+    arrays live in one EmbeddingState that is swapped with a single
+    assignment; a query reads ``state`` once and never mixes two versions.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.path.join(settings.MODEL_OUTPUT_DIR, "embeddings")
+        self.path: Optional[str] = None
+        self.catalog_version: Optional[str] = None
+        self.watermark: Optional[datetime] = None
+        self.state = EmbeddingState.from_build(np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32))
+        self._lock = threading.Lock()
+        self.full_builds = 0
+        self.delta_refreshes = 0
+        self.delta_rows = 0
+
+    def __len__(self) -> int:
+        return len(self.state.row_by_id)
+
+    def ensure_fresh(self, db: Session, catalog_version: Optional[str]):
+        """Apply catalog changes since the last refresh, rebuilding only when they pile up"""
+        if self.catalog_version is not None and self.catalog_version == catalog_version:
+            return
+        with self._lock:
+            if self.catalog_version is not None and self.catalog_version == catalog_version:
+                return
+            refreshed_at = db.execute(select(func.now())).scalar()
+            if self.watermark is None and not self.load():
+                self.build(db, catalog_version, refreshed_at)
+                return
+
+            self._apply_delta(db)
+            state = self.state
+            if state.changed_rows() > settings.EMBEDDING_REBUILD_FRACTION * max(len(state.ids), settings.EMBEDDING_ANN_MIN_ROWS):
+                self.build(db, catalog_version, refreshed_at)
+                return
+            self.catalog_version = catalog_version
+            self.watermark = refreshed_at
+
+    def build(self, db: Session, catalog_version: Optional[str], refreshed_at: datetime):
+        """Bulk-load embeddings from the database and publish them as a new generation"""
+        started = time.perf_counter()
+        ids: List[int] = []
+        rows: List[np.ndarray] = []
+        query = db.query(Product.id, Product.embedding).filter(Product.embedding.isnot(None))
+        for product_id, text in query.yield_per(1000):
+            vector = parse_embedding(text)
+            if vector is None or (rows and len(vector) != len(rows[0])):
+                continue
+            ids.append(product_id)
+            rows.append(vector)
+
+        vectors = _normalize(np.vstack(rows)).astype(np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+        state = EmbeddingState.from_build(np.array(ids, dtype=np.int64), vectors, *_train_ivf(vectors))
+
+        name, directory = new_generation(self.directory)
+        np.save(os.path.join(directory, "ids.npy"), state.ids)
+        np.save(os.path.join(directory, "vectors.npy"), state.vectors)
+        if state.centroids is not None:
+            np.save(os.path.join(directory, "centroids.npy"), state.centroids)
+            np.save(os.path.join(directory, "list_rows.npy"), state.list_rows)
+            np.save(os.path.join(directory, "list_offsets.npy"), state.list_offsets)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({
+                "format": EMBEDDING_FORMAT,
+                "catalog_version": catalog_version,
+                "watermark": refreshed_at.isoformat(),
+                "ivf": state.centroids is not None,
+            }, f)
+        publish_generation(self.directory, name)
+
+        self.state = state
+        self.path = directory
+        self.catalog_version = catalog_version
+        self.watermark = refreshed_at
+        self.full_builds += 1
+        logger.info(f"Built embedding index for {len(ids)} products in {time.perf_counter() - started:.3f}s")
+
+    def load(self) -> bool:
+        """Memory-map the current generation; the next delta catches up from its watermark"""
+        directory = current_generation(self.directory)
+        if directory is None:
+            return False
+        try:
+            with open(os.path.join(directory, "meta.json")) as f:
+                meta = json.load(f)
+            if meta.get("format") != EMBEDDING_FORMAT:
+                return False
+
+            def mapped(filename):
+                return np.load(os.path.join(directory, filename), mmap_mode="r")
+
+            ivf = ()
+            if meta["ivf"]:
+                ivf = (
+                    np.asarray(mapped("centroids.npy")),
+                    mapped("list_rows.npy"),
+                    np.asarray(mapped("list_offsets.npy")),
+                )
+            state = EmbeddingState.from_build(mapped("ids.npy"), mapped("vectors.npy"), *ivf)
+            watermark = datetime.fromisoformat(meta["watermark"])
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+
+        self.state = state
+        self.path = directory
+        self.watermark = watermark
+        logger.info(f"Loaded embedding index for {len(state.ids)} products from {directory}")
+        return True
+
+    def _apply_delta(self, db: Session):
+        state = self.state
+        since = self.watermark - timedelta(seconds=settings.CATALOG_REFRESH_OVERLAP_SECONDS)
+        changed = db.execute(
+            select(Product.id, Product.embedding).where(Product.updated_at >= since)
+        ).all()
+
+        live_ids = np.fromiter(
+            db.execute(select(Product.id).where(Product.embedding.isnot(None))).scalars(), dtype=np.int64
+        )
+        known_ids = np.fromiter(state.row_by_id, dtype=np.int64, count=len(state.row_by_id))
+        changed_ids = np.array([row.id for row in changed], dtype=np.int64)
+        deleted = np.setdiff1d(known_ids, live_ids)
+        # Rows without a usable timestamp are still found by their id
+        missing = np.setdiff1d(np.setdiff1d(live_ids, known_ids), changed_ids)
+        if len(missing):
+            changed += db.execute(
+                select(Product.id, Product.embedding).where(Product.id.in_(missing.tolist()))
+            ).all()
+
+        alive = state.alive.copy()
+        row_by_id = dict(state.row_by_id)
+        for product_id in deleted.tolist():
+            alive[row_by_id.pop(product_id)] = False
+
+        dim = state.vectors.shape[1] if len(state.ids) else state.extra_vectors.shape[1]
+        new_ids: List[int] = []
+        new_rows: List[np.ndarray] = []
+        for product_id, text in changed:
+            vector = parse_embedding(text)
+            row = row_by_id.get(product_id)
+            if vector is not None:
+                vector = _normalize(vector)
+                if dim and len(vector) != dim:
+                    vector = None
+                elif row is not None and np.array_equal(state.vector(row), vector):
+                    # Re-read through the overlap window but unchanged
+                    continue
+            if row is not None:
+                alive[row_by_id.pop(product_id)] = False
+            if vector is not None:
+                dim = len(vector)
+                row_by_id[product_id] = len(alive) + len(new_ids)
+                new_ids.append(product_id)
+                new_rows.append(vector)
+
+        extra_ids, extra_vectors = state.extra_ids, state.extra_vectors
+        if new_ids:
+            extra_vectors = np.vstack([extra_vectors.reshape(-1, dim), np.vstack(new_rows)]).astype(np.float32)
+            extra_ids = np.concatenate([extra_ids, np.array(new_ids, dtype=np.int64)])
+            alive = np.concatenate([alive, np.ones(len(new_ids), dtype=bool)])
+        self.state = state._replace(extra_ids=extra_ids, extra_vectors=extra_vectors, alive=alive, row_by_id=row_by_id)
+
+        self.delta_refreshes += 1
+        self.delta_rows += len(new_ids) + len(deleted)
+        logger.info(f"Refreshed embedding index: {len(new_ids)} changed, {len(deleted)} deleted, {len(row_by_id)} products")
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int = 10,
+        nprobe: Optional[int] = None,
+        exclude_id: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """Return (product_id, cosine similarity) pairs, best first"""
+        state = self.state
+        if not state.alive.any():
+            return []
+
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        if state.centroids is None:
+            base_rows = np.arange(len(state.ids))
+        else:
+            nprobe = min(nprobe or settings.EMBEDDING_IVF_NPROBE, len(state.centroids))
+            cell_scores = state.centroids @ query
+            cells = np.argpartition(-cell_scores, nprobe - 1)[:nprobe]
+            base_rows = np.concatenate([
+                state.list_rows[state.list_offsets[c]:state.list_offsets[c + 1]] for c in cells
+            ])
+        base_rows = base_rows[state.alive[base_rows]]
+        # Rows changed since the build are always scanned exactly
+        extra_rows = np.flatnonzero(state.alive[len(state.ids):])
+
+        candidate_ids = np.concatenate([state.ids[base_rows], state.extra_ids[extra_rows]])
+        scores = np.concatenate([
+            _scores(state.vectors, base_rows, query),
+            _scores(state.extra_vectors, extra_rows, query),
+        ])
+        if exclude_id is not None:
+            scores[candidate_ids == exclude_id] = -np.inf
+
+        top_k = min(top_k, len(candidate_ids))
+        if top_k <= 0:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [
+            (int(candidate_ids[i]), float(scores[i]))
+            for i in best
+            if np.isfinite(scores[i])
+        ]
+
+    def similar_to_product(self, product_id: int, top_k: int = 10, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        state = self.state
+        row = state.row_by_id.get(product_id)
+        if row is None:
+            return []
+        return self.search(state.vector(row), top_k=top_k, nprobe=nprobe, exclude_id=product_id)
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        return {
+            "path": self.path,
+            "products": len(state.row_by_id),
+            "changed_since_build": state.changed_rows(),
+            "ivf_cells": len(state.centroids) if state.centroids is not None else 0,
+            "full_builds": self.full_builds,
+            "delta_refreshes": self.delta_refreshes,
+            "delta_rows": self.delta_rows,
+        }
+
+
+def _train_ivf(vectors: np.ndarray) -> tuple:
+    """IVF centroids and cell lists for the rows of vectors; empty for small catalogs"""
+    n = len(vectors)
+    if n < settings.EMBEDDING_ANN_MIN_ROWS:
+        # Small catalogs are cheaper to scan exactly
+        return ()
+
+    nlist = settings.EMBEDDING_IVF_NLIST or int(np.sqrt(n))
+    nlist = max(1, min(nlist, n))
+    rng = np.random.default_rng(0)
+    sample_size = min(n, nlist * 64)
+    sample = np.asarray(vectors[np.sort(rng.choice(n, size=sample_size, replace=False))])
+    centroids = _spherical_kmeans(sample, nlist, settings.EMBEDDING_KMEANS_ITERATIONS)
+
+    assignments = np.empty(n, dtype=np.int64)
+    for start in range(0, n, 65536):
+        chunk = np.asarray(vectors[start:start + 65536])
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+
+    list_rows = np.argsort(assignments, kind="stable")
+    list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=nlist), out=list_offsets[1:])
+    return centroids, list_rows, list_offsets
+
+
+def _scores(vectors: np.ndarray, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+    if not len(rows):
+        return np.zeros(0, dtype=np.float32)
+    return np.asarray(vectors[rows]) @ query
+
+
+embedding_index = EmbeddingIndex()
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.recommender.index import recommender
+from app.recommender.snapshot import CURRENT_FILE
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[Executor] = None
+_worker_generation: Optional[int] = None
+
+
+def uses_process_pool() -> bool:
+    return settings.RECOMMENDER_EXECUTOR == "process"
+
+
+def get_executor() -> Executor:
+    """Pool that runs CPU-bound TF-IDF scoring off the event loop"""
+    global _executor
+    if _executor is None:
+        if uses_process_pool():
+            # forkserver, not fork: the server is multi-threaded by the time the pool starts
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.RECOMMENDER_POOL_SIZE,
+                mp_context=multiprocessing.get_context("forkserver")
+            )
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECOMMENDER_POOL_SIZE,
+                thread_name_prefix="recommender"
+            )
+        logger.info(f"Started {settings.RECOMMENDER_EXECUTOR} pool with {settings.RECOMMENDER_POOL_SIZE} workers")
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _recommend_in_worker(query: str, top_k: int) -> List[Dict[str, Any]]:
+    """Entry point for pool processes.
+
+    Child processes do not own the index; they attach to the snapshot the
+    parent publishes and re-attach whenever a new generation appears.
+    """
+    global _worker_generation
+    try:
+        generation = os.stat(os.path.join(recommender.snapshot_dir, CURRENT_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        generation = None
+
+    if generation != _worker_generation:
+        if not recommender.load_snapshot():
+            raise ValueError("Recommender snapshot not available in worker process")
+        _worker_generation = generation
+
+    return recommender.recommend_similar_products(query=query, top_k=top_k)
+
+
+async def recommend_similar_products(query: str, top_k: int) -> List[Dict[str, Any]]:
+    loop = asyncio.get_running_loop()
+    if uses_process_pool():
+        return await loop.run_in_executor(get_executor(), _recommend_in_worker, query, top_k)
+    return await loop.run_in_executor(get_executor(), recommender.recommend_similar_products, query, top_k)
@@ -0,0 +1,19 @@
+import re
+import unicodedata
+
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+_TOKEN = re.compile(r"\w+")
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a search query for cache keys and retrieval.
+
+    Applies NFKC, casefolds, splits on non-word characters and drops the
+    English stop words the TF-IDF vectorizer ignores anyway, so "Laptop",
+    " laptop " and "a laptop" share one entry. A query made only of stop
+    words keeps them rather than collapsing to an empty string.
+    """
+    tokens = _TOKEN.findall(unicodedata.normalize("NFKC", query).casefold())
+    content = [t for t in tokens if t not in ENGLISH_STOP_WORDS]
+    return " ".join(content or tokens)
@@ -0,0 +1,62 @@
+import fcntl
+import logging
+import os
+from typing import Optional
+
+from app.recommender.snapshot import CURRENT_FILE
+
+logger = logging.getLogger(__name__)
+
+
+class SharedIndexCoordinator:
+    """Coordinates one builder and many read-only workers over a snapshot directory.
+
+    The builder is elected with a non-blocking exclusive flock on a lock
+    file, so exactly one process per box publishes generations; if it dies
+    the lock is released and another worker can take over. Workers attach
+    to the memory-mapped generation named by CURRENT, which lets the OS
+    share the pages between all of them.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock_file = None
+        self._current_mtime: Optional[int] = None
+
+    @property
+    def is_builder(self) -> bool:
+        return self._lock_file is not None
+
+    def try_become_builder(self) -> bool:
+        if self._lock_file is not None:
+            return True
+
+        os.makedirs(self.root, exist_ok=True)
+        lock_file = open(os.path.join(self.root, "builder.lock"), "a+")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        logger.info(f"Process {os.getpid()} is the recommendation index builder")
+        return True
+
+    def release(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def generation_changed(self) -> bool:
+        """Cheap stat-based check for a newly published generation"""
+        try:
+            mtime = os.stat(os.path.join(self.root, CURRENT_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+        if mtime == self._current_mtime:
+            return False
+        self._current_mtime = mtime
+        return True
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import shutil
+import time
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+CURRENT_FILE = "CURRENT"
+STRING_COLUMNS = ("name", "description", "category", "image_url")
+
+
+class ProductTable(Sequence):
+    """Read-only product rows backed by memory-mapped column files.
+
+    Rows are decoded into the usual product dicts only when accessed, so
+    loading a snapshot does not materialize the catalog.
+    """
+
+    def __init__(self, ids: np.ndarray, prices: np.ndarray, columns: Dict[str, tuple]):
+        self.ids = ids
+        self.prices = prices
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _string(self, column: str, row: int) -> Optional[str]:
+        offsets, blob, nulls = self.columns[column]
+        if nulls[row]:
+            return None
+        return bytes(blob[offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        return {
+            "id": int(self.ids[row]),
+            "name": self._string("name", row),
+            "description": self._string("description", row),
+            "price": float(self.prices[row]),
+            "category": self._string("category", row),
+            "image_url": self._string("image_url", row),
+            "brand": "Unknown",
+            "reviews_count": 0
+        }
+
+
+def _write_strings(directory: str, column: str, values: List[Optional[str]]):
+    encoded = [(v or "").encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(os.path.join(directory, f"{column}.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(directory, f"{column}_offsets.npy"), offsets)
+    np.save(os.path.join(directory, f"{column}_nulls.npy"), np.array([v is None for v in values], dtype=bool))
+
+
+def _map_strings(directory: str, column: str) -> tuple:
+    path = os.path.join(directory, f"{column}.bin")
+    # numpy cannot memory-map an empty file
+    if os.path.getsize(path):
+        blob = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        blob = np.zeros(0, dtype=np.uint8)
+    offsets = np.load(os.path.join(directory, f"{column}_offsets.npy"), mmap_mode="r")
+    nulls = np.load(os.path.join(directory, f"{column}_nulls.npy"), mmap_mode="r")
+    return offsets, blob, nulls
+
+
+def current_generation(root: str) -> Optional[str]:
+    """Path of the generation the CURRENT file points at, if any"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(root, name) if name else None
+
+
+def save_snapshot(
+    root: str,
+    vectorizer: TfidfVectorizer,
+    product_vectors: sp.csr_matrix,
+    products: List[Dict[str, Any]],
+    catalog_version: Optional[str],
+    fitted_tokens: int = 0,
+    keep: int = 2
+) -> str:
+    """Write a new snapshot generation and atomically make it current.
+
+    Each snapshot lives in its own generation directory; the CURRENT file
+    is swapped with os.replace so readers never see a partial write.
+    Returns the path of the new generation.
+    """
+    name, directory = new_generation(root)
+
+    terms = vectorizer.get_feature_names_out()
+    csr = product_vectors.tocsr()
+    np.save(os.path.join(directory, "vocabulary.npy"), np.asarray(terms, dtype=str))
+    np.save(os.path.join(directory, "idf.npy"), vectorizer.idf_)
+    np.save(os.path.join(directory, "data.npy"), csr.data)
+    np.save(os.path.join(directory, "indices.npy"), csr.indices)
+    np.save(os.path.join(directory, "indptr.npy"), csr.indptr)
+    np.save(os.path.join(directory, "product_ids.npy"), np.array([p["id"] for p in products], dtype=np.int64))
+    np.save(os.path.join(directory, "prices.npy"), np.array([p["price"] or 0.0 for p in products], dtype=np.float64))
+    for column in STRING_COLUMNS:
+        _write_strings(directory, column, [p.get(column) for p in products])
+
+    meta = {
+        "format": SNAPSHOT_FORMAT,
+        "catalog_version": catalog_version,
+        "built_at": datetime.utcnow().isoformat(),
+        "shape": list(csr.shape),
+        "fitted_tokens": fitted_tokens,
+    }
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    publish_generation(root, name, keep=keep)
+    logger.info(f"Saved recommendation index snapshot {name} (catalog version {catalog_version})")
+    return directory
+
+
+def new_generation(root: str) -> tuple:
+    """Create an empty generation directory under root; returns (name, path)"""
+    os.makedirs(root, exist_ok=True)
+    name = f"gen-{time.time_ns()}-{os.getpid()}"
+    directory = os.path.join(root, name)
+    os.makedirs(directory)
+    return name, directory
+
+
+def publish_generation(root: str, name: str, keep: int = 2):
+    """Atomically point CURRENT at a fully written generation and prune old ones"""
+    pointer = os.path.join(root, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(pointer, "w") as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(root, CURRENT_FILE))
+    _prune_generations(root, keep=keep)
+
+
+def _prune_generations(root: str, keep: int):
+    # Unlinking files that another process still has mapped is safe on POSIX
+    generations = sorted(
+        (d for d in os.listdir(root) if d.startswith("gen-")),
+        key=lambda d: os.path.getmtime(os.path.join(root, d)),
+    )
+    current = current_generation(root)
+    for name in generations[:-keep]:
+        path = os.path.join(root, name)
+        if path != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_snapshot(root: str) -> Optional[Dict[str, Any]]:
+    """Memory-map the current snapshot generation.
+
+    Returns None when there is no usable snapshot. Nothing is unpickled or
+    re-tokenized: the vectorizer is rebuilt from the stored vocabulary and
+    IDF weights, and the CSR arrays stay memory-mapped.
+    """
+    directory = current_generation(root)
+    if directory is None or not os.path.isdir(directory):
+        return None
+
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("format") != SNAPSHOT_FORMAT:
+            logger.warning(f"Ignoring snapshot {directory} with unsupported format {meta.get('format')}")
+            return None
+
+        def mapped(filename):
+            return np.load(os.path.join(directory, filename), mmap_mode="r")
+
+        terms = np.load(os.path.join(directory, "vocabulary.npy"))
+        vectorizer = TfidfVectorizer(
+            stop_words='english',
+            vocabulary={term: i for i, term in enumerate(terms.tolist())}
+        )
+        vectorizer.idf_ = np.asarray(mapped("idf.npy"))
+
+        product_vectors = sp.csr_matrix(
+            (mapped("data.npy"), mapped("indices.npy"), mapped("indptr.npy")),
+            shape=tuple(meta["shape"]),
+            copy=False
+        )
+        products = ProductTable(
+            ids=mapped("product_ids.npy"),
+            prices=mapped("prices.npy"),
+            columns={column: _map_strings(directory, column) for column in STRING_COLUMNS},
+        )
+    except Exception as e:
+        logger.error(f"Error loading recommendation index snapshot from {directory}: {str(e)}")
+        return None
+
+    return {
+        "path": directory,
+        "vectorizer": vectorizer,
+        "product_vectors": product_vectors,
+        "products": products,
+        "catalog_version": meta.get("catalog_version"),
+        "built_at": datetime.fromisoformat(meta["built_at"]),
+        "fitted_tokens": meta.get("fitted_tokens", 0),
+    }
@@ -0,0 +1,96 @@
+"""Event-loop throughput with the sync vs the async database session.
+
+Runs the per-request user lookup from get_current_user under concurrency,
+first through the blocking SessionLocal (the old pattern inside async
+routes) and then through AsyncSessionLocal. A heartbeat task measures how
+long the event loop is stalled while each runs.
+
+    python -m benchmarks.async_db --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import select
+
+from app.db.models import User
+from app.db.session import AsyncSessionLocal, SessionLocal, async_engine
+
+
+async def _heartbeat(lags, stop, interval=0.001):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - expected, 0.0))
+
+
+async def _sync_lookup(username):
+    db = SessionLocal()
+    try:
+        return db.query(User).filter(User.username == username).first()
+    finally:
+        db.close()
+
+
+async def _async_lookup(username):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.username == username))
+        return result.scalars().first()
+
+
+async def _run(lookup, username, requests, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await lookup(username)
+            latencies.append(time.perf_counter() - started)
+
+    lags = []
+    stop = asyncio.Event()
+    heartbeat = asyncio.ensure_future(_heartbeat(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await heartbeat
+
+    latencies.sort()
+    return {
+        "requests/s": requests / elapsed,
+        "p50 ms": latencies[len(latencies) // 2] * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "loop lag max ms": max(lags, default=0.0) * 1000,
+        "loop lag mean ms": statistics.mean(lags) * 1000 if lags else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        user = db.query(User).first()
+    finally:
+        db.close()
+    if user is None:
+        raise SystemExit("No users in the database; run /populate-db first")
+
+    for name, lookup in (("sync SessionLocal", _sync_lookup), ("async AsyncSessionLocal", _async_lookup)):
+        # Warm the pools so connection setup is not measured
+        await lookup(user.username)
+        stats = await _run(lookup, user.username, args.requests, args.concurrency)
+        print(f"{name:>24}: " + ", ".join(f"{k} {v:.1f}" for k, v in stats.items()))
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""Memory and refresh cost of the columnar catalog store vs a dict per product.
+
+Fills an in-memory SQLite catalog shaped like the sample data (a handful of
+categories, a small pool of repeated descriptions), then compares:
+
+* the memory held by the catalog as a list of product dicts against the
+  CatalogStore columns plus their string table (tracemalloc);
+* reloading the whole catalog as dicts against a CatalogStore delta
+  refresh after a batch of products is edited and a few are deleted.
+
+    python -m benchmarks.catalog_store --products 50000 --changes 500
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.db.base import Base
+from app.db.models import Category, Product
+from app.recommender.catalog import CatalogStore
+
+DESCRIPTIONS = [
+    "High-quality product that will last for years.",
+    "Great value for your money with excellent features.",
+    "Perfect for everyday use with outstanding durability.",
+    "Premium design with attention to every detail.",
+    "Innovative technology meets elegant design.",
+    "Best-in-class performance at an affordable price.",
+    "Lightweight and portable, perfect for travel.",
+    "Energy-efficient design saves you money.",
+    "Handcrafted with premium materials.",
+    "Award-winning design and functionality.",
+]
+
+
+def _populate(db, products: int):
+    categories = [Category(name=f"Category {i}") for i in range(10)]
+    db.add_all(categories)
+    db.commit()
+    rng = random.Random(0)
+    db.execute(Product.__table__.insert(), [
+        {
+            "name": f"Product {i} {rng.choice(categories).name}",
+            "description": rng.choice(DESCRIPTIONS),
+            "price": round(rng.uniform(9.99, 999.99), 2),
+            "category_id": rng.choice(categories).id,
+            "image_url": f"https://example.com/images/{i}.jpg",
+        }
+        for i in range(products)
+    ])
+    db.commit()
+
+
+def _load_dicts(db):
+    """The dict-per-product load the store replaces"""
+    stmt = (
+        select(
+            Product.id, Product.name, Product.description, Product.price,
+            Category.name.label("category"), Product.image_url,
+        )
+        .outerjoin(Category, Product.category_id == Category.id)
+        .order_by(Product.id)
+    )
+    return [
+        {
+            "id": row.id,
+            "name": row.name,
+            "description": row.description,
+            "price": row.price,
+            "category": row.category,
+            "image_url": row.image_url,
+            "brand": "Unknown",
+            "reviews_count": 0
+        }
+        for row in db.execute(stmt)
+    ]
+
+
+def _measure(load):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = load()
+    seconds = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--changes", type=int, default=500)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    _populate(db, args.products)
+    # A serving process starts well after the catalog was written
+    time.sleep(settings.CATALOG_REFRESH_OVERLAP_SECONDS + 1)
+
+    products, dict_bytes, dict_seconds = _measure(lambda: _load_dicts(db))
+    del products
+    store = CatalogStore()
+    _, store_bytes, store_seconds = _measure(lambda: store.refresh(db))
+
+    print(f"{'dict per product':>18}: {dict_bytes / args.products:.0f} bytes/product, load {dict_seconds * 1000:.1f} ms")
+    print(f"{'catalog store':>18}: {store_bytes / args.products:.0f} bytes/product, load {store_seconds * 1000:.1f} ms")
+
+    rng = random.Random(1)
+    ids = rng.sample(range(1, args.products + 1), args.changes + 10)
+    for pid in ids[:args.changes]:
+        db.get(Product, pid).price = round(rng.uniform(9.99, 999.99), 2)
+    for pid in ids[args.changes:]:
+        db.delete(db.get(Product, pid))
+    db.commit()
+
+    started = time.perf_counter()
+    _load_dicts(db)
+    reload_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    store.refresh(db)
+    refresh_seconds = time.perf_counter() - started
+
+    print(f"{'full dict reload':>18}: {reload_seconds * 1000:.1f} ms")
+    print(f"{'store delta':>18}: {refresh_seconds * 1000:.1f} ms "
+          f"({store.delta_rows} rows re-read, {store.deleted_rows} deleted)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Point the app at throwaway storage before any app module reads its settings
+TEST_DIR = tempfile.mkdtemp(prefix="recommendation-tests-")
+atexit.register(shutil.rmtree, TEST_DIR, ignore_errors=True)
+os.environ["MODEL_OUTPUT_DIR"] = TEST_DIR
+
+from app.core import config  # noqa: E402
+
+config.Settings.DATABASE_URI = property(lambda self: f"sqlite:///{os.path.join(TEST_DIR, 'app.db')}")
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.auth import create_access_token, get_current_user, token_cache_stats
+from app.db.base import Base
+from app.db.models import User
+from app.db.session import AsyncSessionLocal, SessionLocal, engine
+
+
+@pytest.fixture
+def user():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = User(username="token-cache-user", email="token-cache@example.com", hashed_password="x", is_active=True)
+    db.add(user)
+    db.commit()
+    yield db, user
+    db.delete(user)
+    db.commit()
+    db.close()
+
+
+def test_verified_tokens_are_cached_until_the_user_changes(user):
+    db, row = user
+    token = create_access_token({"sub": row.username})
+
+    async def current_user():
+        async with AsyncSessionLocal() as session:
+            return await get_current_user(token=token, db=session)
+
+    async def run():
+        hits = token_cache_stats()["hits"]
+        first = await current_user()
+        second = await current_user()
+        assert first == second
+        assert first.username == "token-cache-user"
+        assert token_cache_stats()["hits"] == hits + 1
+
+        # Renaming the user invalidates tokens issued for the old name
+        row.username = "token-cache-user-renamed"
+        db.commit()
+        with pytest.raises(HTTPException) as error:
+            await current_user()
+        assert error.value.status_code == 401
+
+    asyncio.run(run())
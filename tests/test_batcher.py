@@ -0,0 +1,52 @@
+import asyncio
+
+from app.llm.batcher import MicroBatcher
+
+
+def test_batches_concurrent_prompts():
+    calls = []
+
+    async def send_batch(prompts):
+        calls.append(list(prompts))
+        return [prompt.upper() for prompt in prompts]
+
+    async def run():
+        batcher = MicroBatcher(send_batch, window_ms=10, max_batch_size=8)
+        return await asyncio.gather(*(batcher.submit(p) for p in ["a", "b", "c"]))
+
+    assert asyncio.run(run()) == ["A", "B", "C"]
+    assert calls == [["a", "b", "c"]]
+
+
+def test_cancelled_send_releases_waiting_callers():
+    started = asyncio.Event()
+
+    async def send_batch(prompts):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def run():
+        batcher = MicroBatcher(send_batch, window_ms=1, max_batch_size=8)
+        waiters = [asyncio.ensure_future(batcher.submit(p)) for p in ["a", "b"]]
+        await started.wait()
+        for task in list(batcher._in_flight):
+            task.cancel()
+        return await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), 1)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+
+
+def test_missing_completions_fail_instead_of_hanging():
+    async def send_batch(prompts):
+        return ["only one"]
+
+    async def run():
+        batcher = MicroBatcher(send_batch, window_ms=1, max_batch_size=8)
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True), 1
+        )
+
+    first, second = asyncio.run(run())
+    assert first == "only one"
+    assert isinstance(second, KeyError)
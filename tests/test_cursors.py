@@ -0,0 +1,43 @@
+import pytest
+from fastapi import HTTPException
+
+from app.api.recommendation import _decode_cursor, _encode_cursor, _hybrid_page
+
+
+def _ranked(prefix, ids):
+    return [
+        {"id": pid, "name": f"{prefix} {pid}", "price": 10.0, "match_score": 90 - i, "brand": "Unknown"}
+        for i, pid in enumerate(ids)
+    ]
+
+
+def test_cursor_round_trip():
+    cursor = _encode_cursor("search:headphones", 40)
+    assert _decode_cursor(cursor, "search:headphones") == 40
+    assert _decode_cursor(None, "search:headphones") == 0
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", _encode_cursor("search:other query", 20)])
+def test_foreign_or_corrupt_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        _decode_cursor(cursor, "search:headphones")
+    assert error.value.status_code == 400
+
+
+def test_hybrid_pages_do_not_repeat_products():
+    rankings = {"tfidf": _ranked("Content", range(1, 16)), "llm": _ranked("Title", [12, 3, 20, 21, 22, 5])}
+
+    pages = []
+    page_index, has_more = 0, True
+    while has_more:
+        page, has_more = _hybrid_page(rankings, "query", 4, 0.5, 20, page_index)
+        pages.append([rec["id"] for rec in page])
+        page_index += 1
+
+    served = [pid for page in pages for pid in page]
+    assert len(served) == len(set(served)) == 18
+    assert all(len(page) == 4 for page in pages[:-1])
+    # Each page keeps the requested content/LLM mix while both lists last
+    assert [rec["source"] for rec in _hybrid_page(rankings, "query", 4, 0.5, 20, 0)[0]] == [
+        "Content-Based", "Content-Based", "Title-Based", "Title-Based"
+    ]
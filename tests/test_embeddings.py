@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.db.base import Base
+from app.db.models import Category, Product
+from app.recommender.embeddings import EmbeddingIndex
+
+DIM = 8
+
+
+def _embedding(rng):
+    return ",".join(str(v) for v in rng.uniform(-1, 1, DIM))
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    category = Category(name="Gadgets")
+    session.add(category)
+    session.commit()
+    rng = np.random.default_rng(0)
+    session.add_all([
+        Product(name=f"Product {i}", description="", price=1.0, category_id=category.id, embedding=_embedding(rng))
+        for i in range(60)
+    ])
+    session.commit()
+    yield session
+    session.close()
+
+
+def _edit_catalog(db):
+    rng = np.random.default_rng(1)
+    products = db.query(Product).order_by(Product.id).all()
+    for product in products[:5]:
+        product.embedding = _embedding(rng)
+    for product in products[5:8]:
+        db.delete(product)
+    products[8].embedding = None
+    db.add_all([
+        Product(name=f"New product {i}", description="", price=1.0, category_id=products[0].category_id, embedding=_embedding(rng))
+        for i in range(4)
+    ])
+    db.commit()
+
+
+def _neighbours(index, db):
+    return {
+        product_id: index.similar_to_product(product_id, top_k=5, nprobe=1000)
+        for (product_id,) in db.query(Product.id).filter(Product.embedding.isnot(None))
+    }
+
+
+def _assert_same_neighbours(left, right):
+    assert left.keys() == right.keys()
+    for product_id in left:
+        assert [pid for pid, _ in left[product_id]] == [pid for pid, _ in right[product_id]]
+        np.testing.assert_allclose(
+            [score for _, score in left[product_id]], [score for _, score in right[product_id]], rtol=1e-5
+        )
+
+
+@pytest.mark.parametrize("ann_min_rows", [2000, 20], ids=["exact", "ivf"])
+def test_delta_matches_rebuild(db, tmp_path, monkeypatch, ann_min_rows):
+    monkeypatch.setattr(settings, "EMBEDDING_ANN_MIN_ROWS", ann_min_rows)
+    incremental = EmbeddingIndex(str(tmp_path / "incremental"))
+    incremental.ensure_fresh(db, "v0")
+    assert (incremental.stats()["ivf_cells"] > 0) == (ann_min_rows == 20)
+
+    _edit_catalog(db)
+    incremental.ensure_fresh(db, "v1")
+    assert incremental.full_builds == 1
+    assert incremental.delta_refreshes == 1
+
+    rebuilt = EmbeddingIndex(str(tmp_path / "rebuilt"))
+    rebuilt.ensure_fresh(db, "v1")
+    assert len(incremental) == len(rebuilt) == 60 - 3 - 1 + 4
+    _assert_same_neighbours(_neighbours(incremental, db), _neighbours(rebuilt, db))
+
+    # A restart maps the last generation and catches up from its watermark
+    restarted = EmbeddingIndex(str(tmp_path / "incremental"))
+    restarted.ensure_fresh(db, "v1")
+    assert restarted.full_builds == 0
+    _assert_same_neighbours(_neighbours(restarted, db), _neighbours(rebuilt, db))
+
+
+def test_rebuilds_once_changes_pile_up(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_ANN_MIN_ROWS", 20)
+    monkeypatch.setattr(settings, "EMBEDDING_REBUILD_FRACTION", 0.05)
+    index = EmbeddingIndex(str(tmp_path))
+    index.ensure_fresh(db, "v0")
+    first_generation = index.path
+
+    _edit_catalog(db)
+    index.ensure_fresh(db, "v1")
+
+    assert index.full_builds == 2
+    assert index.path != first_generation
+    assert index.stats()["changed_since_build"] == 0
@@ -0,0 +1,21 @@
+from app.llm.cache import PromptCache
+
+
+def test_rejected_entry_counts_as_miss_and_stays_cached():
+    cache = PromptCache(max_entries=10, ttl=60)
+    # A ranking truncated after two IDs
+    cache.set("prompt", ([3, 1], False), "v1")
+
+    assert cache.get("prompt", "v1", accept=lambda entry: entry[1] or len(entry[0]) >= 5) is None
+    assert cache.get("prompt", "v1", accept=lambda entry: entry[1] or len(entry[0]) >= 2) == ([3, 1], False)
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_new_catalog_version_drops_entries():
+    cache = PromptCache(max_entries=10, ttl=60)
+    cache.set("prompt", ([3, 1], True), "v1")
+
+    assert cache.get("prompt", "v2") is None
+    assert cache.stats()["invalidations"] == 1
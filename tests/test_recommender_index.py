@@ -0,0 +1,75 @@
+import pytest
+
+from app.core.config import settings
+from app.recommender.catalog import CatalogColumns
+from app.recommender.index import ProductRecommender
+
+
+def _product(product_id, name, description="Sturdy and reliable for everyday use.", category="Gadgets"):
+    return {
+        "id": product_id,
+        "name": name,
+        "description": description,
+        "price": 10.0,
+        "category": category,
+        "image_url": None,
+        "brand": "Unknown",
+        "reviews_count": 0
+    }
+
+
+@pytest.fixture
+def index(tmp_path):
+    recommender = ProductRecommender()
+    recommender.snapshot_dir = str(tmp_path)
+    return recommender
+
+
+def _search_ids(index, query):
+    return [r["id"] for r in index.recommend_similar_products(query, top_k=10) if r["match_score"] > 0]
+
+
+def test_product_created_in_empty_catalog_is_searchable(index):
+    index.fit(CatalogColumns.from_products([]), catalog_version="v0")
+
+    index.record_upsert(_product(1, "Zephyr drone"), catalog_version="v1")
+    assert index.apply_changes() == 1
+
+    assert _search_ids(index, "zephyr") == [1]
+    assert index.info()["product_count"] == 1
+    assert index.catalog_version == "v1"
+
+
+def test_incremental_edits_and_deletes(index):
+    index.fit(CatalogColumns.from_products([
+        _product(1, "Wireless headphones"),
+        _product(2, "Running shoes"),
+        _product(3, "Coffee grinder"),
+    ]), catalog_version="v0")
+
+    index.record_upsert(_product(2, "Trail running shoes"), catalog_version="v1")
+    index.record_delete(3, catalog_version="v2")
+    assert index.apply_changes() == 2
+
+    assert _search_ids(index, "running shoes") == [2]
+    assert _search_ids(index, "coffee grinder") == []
+    assert index.info()["product_count"] == 2
+    assert index.info()["tombstoned_rows"] == 2
+
+
+def test_unseen_terms_become_searchable_after_max_age(index, monkeypatch):
+    index.fit(CatalogColumns.from_products([
+        _product(pid, f"Classic item {pid}") for pid in range(1, 31)
+    ]), catalog_version="v0")
+
+    # Two unseen tokens stay far below the drift threshold
+    index.record_upsert(_product(7, "Zephyr drone"), catalog_version="v1")
+    index.apply_changes()
+    assert _search_ids(index, "zephyr") == []
+
+    monkeypatch.setattr(settings, "RECOMMENDER_MAX_UNSEEN_SECONDS", 0)
+    index._refit_if_unseen_overdue()
+
+    assert _search_ids(index, "zephyr") == [7]
+    assert index.info()["vocabulary_drift"] == 0
+    assert index.catalog_version == "v1"
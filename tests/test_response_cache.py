@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from app.cache.redis import MemcachedClient
+from app.core.config import settings
+
+
+@pytest.fixture(autouse=True)
+def no_early_refresh(monkeypatch):
+    # XFetch is random; these tests pin down the deterministic soft-TTL behaviour
+    monkeypatch.setattr(settings, "CACHE_XFETCH_BETA", 0.0)
+
+
+class Counter:
+    def __init__(self, seconds: float = 0.0):
+        self.seconds = seconds
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.seconds)
+        return {"value": self.calls}
+
+
+def test_fresh_entries_are_served_without_recomputing():
+    compute = Counter()
+
+    async def run():
+        client = MemcachedClient()
+        first = await client.get_or_compute("key", compute, soft_ttl=60, hard_ttl=120)
+        second = await client.get_or_compute("key", compute, soft_ttl=60, hard_ttl=120)
+        return first, second, client.stats()["swr"]
+
+    first, second, swr = asyncio.run(run())
+    assert first == second == {"value": 1}
+    assert compute.calls == 1
+    assert (swr["computes"], swr["fresh_hits"]) == (1, 1)
+
+
+def test_stale_entry_is_served_while_one_refresh_runs():
+    compute = Counter()
+
+    async def run():
+        client = MemcachedClient()
+        await client.put("key", {"value": 0}, soft_ttl=0, hard_ttl=120)
+        stale = await asyncio.gather(*(
+            client.get_or_compute("key", compute, soft_ttl=60, hard_ttl=120) for _ in range(5)
+        ))
+        await asyncio.gather(*client._refreshing.values())
+        return stale, await client.get_cached("key", compute, soft_ttl=60, hard_ttl=120)
+
+    stale, refreshed = asyncio.run(run())
+    assert stale == [{"value": 0}] * 5
+    assert refreshed == {"value": 1}
+    assert compute.calls == 1
+
+
+def test_uncacheable_results_are_not_stored():
+    compute = Counter()
+
+    async def run():
+        client = MemcachedClient()
+        for _ in range(2):
+            await client.get_or_compute("key", compute, soft_ttl=60, hard_ttl=120, cacheable=lambda _: False)
+        return await client.get_cached("key", compute, soft_ttl=60, hard_ttl=120)
+
+    assert asyncio.run(run()) is None
+    assert compute.calls == 2
+
+
+def test_workers_sharing_redis_refresh_a_stale_key_once():
+    fakeredis = pytest.importorskip("fakeredis")
+    # Slow enough that every worker reads the stale entry while the first refresh runs
+    compute = Counter(seconds=0.05)
+
+    async def run():
+        server = fakeredis.FakeServer()
+        workers = [MemcachedClient(fakeredis.FakeAsyncRedis(server=server)) for _ in range(3)]
+        await workers[0].put("key", {"value": 0}, soft_ttl=0, hard_ttl=120)
+        # Every worker saw the stale entry and may start a refresh
+        await asyncio.gather(*(worker.get_cached("key", compute, soft_ttl=60, hard_ttl=120) for worker in workers))
+        await asyncio.gather(*(task for worker in workers for task in list(worker._refreshing.values())))
+        return [await worker.get("key") for worker in workers], [worker.stale_serves for worker in workers]
+
+    entries, stale_serves = asyncio.run(run())
+    assert stale_serves == [1, 1, 1]
+    assert compute.calls == 1
+    assert all(entry["value"] == {"value": 1} for entry in entries)
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from app.cache.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", compute) for _ in range(5)))
+        return results, flight.stats()
+
+    results, stats = asyncio.run(run())
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert (stats["leaders"], stats["coalesced"], stats["in_flight"]) == (1, 4, 0)
+
+
+def test_errors_reach_every_waiter():
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("key", compute) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in asyncio.run(run()))
+
+
+def test_waiter_timeout_does_not_cancel_the_computation():
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "late"
+
+    async def run():
+        flight = SingleFlight()
+        with pytest.raises(asyncio.TimeoutError):
+            await flight.do("key", compute, timeout=0.01)
+        # A later caller joins the computation that is still running
+        return await flight.do("key", compute), flight.stats()
+
+    result, stats = asyncio.run(run())
+    assert result == "late"
+    assert (stats["leaders"], stats["timeouts"]) == (1, 1)
@@ -0,0 +1,63 @@
+import os
+
+from app.recommender.catalog import CatalogColumns
+from app.recommender.index import ProductRecommender
+from app.recommender.snapshot import current_generation
+
+
+def _product(product_id, name, category):
+    return {
+        "id": product_id,
+        "name": name,
+        "description": f"{name} for everyday use.",
+        "price": 10.0 + product_id,
+        "category": category,
+        "image_url": None,
+        "brand": "Unknown",
+        "reviews_count": 0
+    }
+
+
+def _matches(recommender, query):
+    # Snapshot rows are sorted by id, so only zero-score ties may come back in another order
+    return [r for r in recommender.recommend_similar_products(query, top_k=3) if r["match_score"] > 0]
+
+
+def _recommender(directory):
+    recommender = ProductRecommender()
+    recommender.snapshot_dir = str(directory)
+    return recommender
+
+
+def test_snapshot_serves_the_same_results(tmp_path):
+    built = _recommender(tmp_path)
+    built.fit(CatalogColumns.from_products([
+        _product(3, "Wireless headphones", "Electronics"),
+        _product(1, "Running shoes", "Sports"),
+        _product(2, "Noise cancelling headphones", "Electronics"),
+    ]), catalog_version="v1")
+    path = built.save_snapshot()
+    assert current_generation(str(tmp_path)) == path
+
+    loaded = _recommender(tmp_path)
+    assert loaded.load_snapshot()
+    assert loaded.catalog_version == "v1"
+    for query in ["headphones", "running shoes", "electronics"]:
+        assert _matches(loaded, query) == _matches(built, query)
+
+
+def test_new_snapshot_replaces_the_current_generation(tmp_path):
+    recommender = _recommender(tmp_path)
+    recommender.fit(CatalogColumns.from_products([_product(1, "Running shoes", "Sports")]), catalog_version="v1")
+    first = recommender.save_snapshot()
+    recommender.record_delete(1, catalog_version="v2")
+    recommender.record_upsert(_product(2, "Trail shoes", "Sports"), catalog_version="v2")
+    recommender.apply_changes()
+    second = recommender.save_snapshot()
+
+    assert second != first
+    loaded = _recommender(tmp_path)
+    assert loaded.load_snapshot()
+    assert loaded.catalog_version == "v2"
+    assert [p["id"] for p in loaded.products] == [2]
+    assert os.path.isdir(second)
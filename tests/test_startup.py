@@ -0,0 +1,26 @@
+from fastapi.testclient import TestClient
+
+from app.db.models import Product, User
+from app.db.session import SessionLocal
+
+
+def test_auto_populate_on_startup(monkeypatch):
+    monkeypatch.setenv("AUTO_POPULATE_DB", "true")
+    from app import main
+
+    with TestClient(main.app) as client:
+        db = SessionLocal()
+        try:
+            first_user = db.query(User).order_by(User.id).first()
+            assert db.query(User).count() == 5
+            assert db.query(Product).count() == 120
+        finally:
+            db.close()
+
+        # Passwords were hashed in the password pool, one per sample user
+        response = client.post("/api/auth/token", data={"username": first_user.username, "password": "password0"})
+        assert response.status_code == 200
+        token = response.json()["access_token"]
+
+        response = client.get("/api/products/index/", headers={"Authorization": f"Bearer {token}"})
+        assert response.json()["product_count"] == 120